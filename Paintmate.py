@@ -1,3 +1,4 @@
+import bisect
 import itertools
 import os
 import sqlite3
@@ -5,9 +6,16 @@ import sys
 import csv
 import datetime
 import webbrowser
-import cv2
-import numpy
 import threading
+import time
+import hashlib
+import json
+import math
+import queue
+import shutil
+import struct
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 
 import uicuis.AboutProgramUi as AboutProgramUi
 import uicuis.ChangeObjectWindowUi as ChangeObjectWindowUi
@@ -17,11 +25,12 @@ import uicuis.ProjectWindowUi as ProjectWindowUi
 import uicuis.RenderAnimationUi as RenderAnimationUi
 import uicuis.RenderSequenceUi as RenderSequenceUi
 
-from PyQt5.QtGui import QPixmap, QPainter, QPen, QColor, QBrush, QImage, QFont
-from PyQt5.QtCore import QTimer, QPoint
+from PyQt5.QtGui import QPixmap, QPainter, QPen, QColor, QBrush, QImage, QFont, QTransform, QPolygon
+from PyQt5.QtCore import QTimer, QPoint, QPointF, QRect, QRectF, QAbstractListModel, QModelIndex, pyqtSignal
 from PyQt5.QtCore import Qt
 from PyQt5.QtWidgets import QMainWindow, QWidget, QLabel, QApplication, QDesktopWidget, QInputDialog, QMessageBox, \
-    QFileDialog, QSizePolicy, QRadioButton, QColorDialog
+    QFileDialog, QSizePolicy, QColorDialog, QListView, QAbstractItemView, QAbstractSlider, QScrollBar, QVBoxLayout, \
+    QPushButton, QCheckBox, QSpinBox, QHBoxLayout
 
 
 def resource_path(relative_path):
@@ -38,14 +47,491 @@ def resource_path(relative_path):
     return os.path.join(base_path, relative_path)
 
 
+def point_to_segment_distance(px, py, x, y, xx, yy):
+    """
+    Distance from the point (px, py) to the segment (x, y) - (xx, yy)
+    :return:
+    """
+
+    dx, dy = xx - x, yy - y
+    if not (dx or dy):
+        return ((px - x) ** 2 + (py - y) ** 2) ** 0.5
+    t = max(0, min(1, ((px - x) * dx + (py - y) * dy) / (dx * dx + dy * dy)))
+    return ((px - x - t * dx) ** 2 + (py - y - t * dy) ** 2) ** 0.5
+
+
+def point_in_polygon(px, py, points):
+    """
+    Even-odd ray casting test, the same fill rule QPainter.drawPolygon uses by default
+    :param points: list of (x, y) tuples
+    :return:
+    """
+
+    inside = False
+    for (x, y), (xx, yy) in zip(points, points[-1:] + points[:-1]):
+        if (y > py) != (yy > py) and px < (xx - x) * (py - y) / (yy - y) + x:
+            inside = not inside
+    return inside
+
+
+def paint_objects(painter, database, objects, tint=None):
+    """
+    Draws rows returned by Database.objects, the painter must already map project coordinates
+    :param painter:
+    :param database: Database the rows were read from, it is asked for points of pens and fillers
+    :param objects:
+    :param tint: optional QColor that replaces the colors of every object, ellipses are left unfilled
+    :return: count of drawn objects and count of drawn points of pens and fillers
+    """
+
+    points_count = 0
+    for elem in objects:
+        (identifier, frame_id, object_stroke_width, object_color, x, y, xx, yy,
+         object_z_index, object_fill_color, name, object_type) = elem[:12]
+        object_color = tint or QColor(*map(int, object_color.split('|')))
+        if object_type == ellipse:
+            painter.setPen(QPen(object_color, object_stroke_width))
+            painter.setBrush(QBrush(QColor(*map(int, object_fill_color.split('|')))) if not tint else Qt.NoBrush)
+            painter.drawEllipse(x, y, xx - x, yy - y)
+        elif object_type == line:
+            painter.setPen(QPen(object_color, object_stroke_width))
+            painter.drawLine(x, y, xx, yy)
+        elif object_type == pen:
+            painter.setBrush(QBrush(object_color))
+            painter.setPen(QPen(QColor(0, 0, 0, 0), 0))
+            points = database.object_points(identifier, pen)
+            points_count += len(points)
+            for _, __, x, y in points:
+                painter.drawEllipse(QPointF(x, y), object_stroke_width, object_stroke_width)
+        else:  # filler
+            painter.setPen(QPen(QColor(0, 0, 0, 0), 0))
+            painter.setBrush(QBrush(object_color))
+            points = database.object_points(identifier, filler)
+            points_count += len(points)
+            painter.drawPolygon(QPolygon([QPoint(x, y) for _, __, x, y in points]))
+    return len(objects), points_count
+
+
+def pixel_window(pixels, left, top, right, bottom):
+    """
+    Clips a box in project coordinates to the array
+    :return: (left, top, right, bottom) of whole pixels or None when nothing is left
+    """
+
+    left, top = max(0, math.floor(left)), max(0, math.floor(top))
+    right, bottom = min(pixels.shape[1], math.ceil(right)), min(pixels.shape[0], math.ceil(bottom))
+    return (left, top, right, bottom) if left < right and top < bottom else None
+
+
+def row_bands(pixels, top, bottom):
+    """
+    Splits rows into bands of at most raster_band_pixels pixels, temporary arrays of the fills are bounded by a band,
+    so large shapes don't take more memory than small ones
+    :return: iterator of (top, bottom) of every band
+    """
+
+    rows = max(1, raster_band_pixels // pixels.shape[1])
+    return ((band_top, min(bottom, band_top + rows)) for band_top in range(top, bottom, rows))
+
+
+def spread(starts, ends):
+    """
+    Concatenates integer ranges, empty ones are skipped
+    :param starts: array of the first values
+    :param ends: array of the ends, they are excluded
+    :return: index of the range of every value and the values
+    """
+
+    import numpy
+
+    lengths = numpy.maximum(ends - starts, 0)
+    return (numpy.repeat(numpy.arange(len(lengths)), lengths),
+            numpy.arange(lengths.sum()) - numpy.repeat(numpy.cumsum(lengths) - lengths - starts, lengths))
+
+
+def pixel_cells(pixels, color):
+    """
+    Views a BGR array as one 3-byte cell per pixel, fancy indexing then copies whole pixels instead of channels
+    :param pixels: array of shape (height, width, 3) with contiguous pixels
+    :param color: (b, g, r)
+    :return: array of shape (height, width) and the color as a cell
+    """
+
+    import numpy
+
+    cell = numpy.dtype((numpy.void, 3))
+    return pixels.view(cell)[..., 0], numpy.array(color, numpy.uint8).view(cell)[0]
+
+
+def fill_spans(pixels, rows, starts, ends, color):
+    """
+    Sets the columns [start, end) of the given rows. Sparse spans are written pixel by pixel and dense ones through
+    an even-odd mask of their bounding box, so thin shapes don't pay for the box around them
+    :param pixels: BGR array
+    :param rows: array of row numbers inside the array
+    :param starts: array of the first columns
+    :param ends: array of the ends of the spans, spans of a row must not overlap
+    :param color: (b, g, r)
+    :return:
+    """
+
+    import numpy
+
+    starts, ends = numpy.clip(starts, 0, pixels.shape[1]), numpy.clip(ends, 0, pixels.shape[1])
+    spans = ends > starts
+    rows, starts, ends = rows[spans], starts[spans], ends[spans]
+    if not len(rows):
+        return
+    cells, color = pixel_cells(pixels, color)
+    top, left = rows.min(), starts.min()
+    height, width = rows.max() + 1 - top, ends.max() + 1 - left
+    if (ends - starts).sum() * 4 < height * width:
+        owners, columns = spread(starts, ends)
+        cells[rows[owners], columns] = color
+        return
+    offsets = (rows - top) * width - left
+    toggles = numpy.bincount(numpy.concatenate((offsets + starts, offsets + ends)), minlength=height * width)
+    mask = toggles.astype(numpy.int8).reshape(height, width).cumsum(axis=1, dtype=numpy.int8)[:, :-1] & 1
+    cells[top:top + height, left:left + width - 1][mask.view(bool)] = color
+
+
+def fill_polygon(pixels, xs, ys, color):
+    """
+    Even-odd scanline fill that sets the pixels whose centers are inside the polygon, as aliased Qt painting does.
+    The crossings of every scanline are sorted and paired into spans
+    :param pixels: BGR array
+    :param xs: x coordinates of the vertices
+    :param ys: y coordinates of the vertices
+    :param color: (b, g, r)
+    :return:
+    """
+
+    import numpy
+
+    xs, ys = numpy.asarray(xs, numpy.float64), numpy.asarray(ys, numpy.float64)
+    if len(xs) < 3 or (window := pixel_window(pixels, xs.min(), ys.min(), xs.max(), ys.max())) is None:
+        return
+    _, top, __, bottom = window
+    next_xs, next_ys = numpy.roll(xs, -1), numpy.roll(ys, -1)
+    # a scanline crosses an edge when its pixel centers are in [lowest y, highest y) of the edge
+    first_rows = numpy.ceil(numpy.minimum(ys, next_ys) - 0.5).astype(numpy.int64)
+    end_rows = numpy.ceil(numpy.maximum(ys, next_ys) - 0.5).astype(numpy.int64)
+    for band_top, band_bottom in row_bands(pixels, top, bottom):
+        edges, rows = spread(numpy.maximum(first_rows, band_top), numpy.minimum(end_rows, band_bottom))
+        crossings = xs[edges] + (rows + 0.5 - ys[edges]) * (next_xs[edges] - xs[edges]) / (next_ys[edges] - ys[edges])
+        order = numpy.lexsort((crossings, rows))
+        rows, columns = rows[order], numpy.ceil(crossings[order] - 0.5).astype(numpy.int64)
+        fill_spans(pixels, rows[::2], columns[::2], columns[1::2], color)
+
+
+def ellipse_spans(center_x, center_y, radius_x, radius_y, rows):
+    """
+    :param rows: array of row numbers
+    :return: arrays of the columns [start, end) whose pixel centers are inside the ellipse, end <= start on rows that
+    miss it
+    """
+
+    import numpy
+
+    share = 1 - ((rows + 0.5 - center_y) / max(radius_y, 1e-9)) ** 2
+    half = max(radius_x, 1e-9) * numpy.sqrt(numpy.maximum(share, 0))
+    return (numpy.floor(center_x - half - 0.5).astype(numpy.int64) + 1,
+            numpy.ceil(center_x + half - 0.5).astype(numpy.int64))
+
+
+def ellipse_distance(dx, dy, radius_x, radius_y):
+    """
+    Approximate signed distance of points to an ellipse, negative inside
+    :param dx: array of offsets from the center
+    :param dy:
+    :return: array of distances
+    """
+
+    import numpy
+
+    radius_x, radius_y = max(radius_x, 1e-9), max(radius_y, 1e-9)
+    level = numpy.sqrt((dx / radius_x) ** 2 + (dy / radius_y) ** 2)
+    gradient = numpy.sqrt((dx / radius_x ** 2) ** 2 + (dy / radius_y ** 2) ** 2)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        return numpy.where(gradient > 0, level * (level - 1) / gradient, -min(radius_x, radius_y))
+
+
+def fill_ellipse(pixels, center_x, center_y, radius_x, radius_y, color, half_width=None):
+    """
+    Sets the pixels whose centers are inside an ellipse or, with half_width, within that distance of its outline.
+    Outlines measure the distance only between two ellipses around the band of the stroke
+    :param pixels: BGR array
+    :param color: (b, g, r)
+    :param half_width: half of the stroke width for an outline
+    :return:
+    """
+
+    import numpy
+
+    margin = half_width or 0
+    if (window := pixel_window(pixels, center_x - radius_x - margin, center_y - radius_y - margin,
+                               center_x + radius_x + margin, center_y + radius_y + margin)) is None:
+        return
+    left, top, right, bottom = window
+    # the distance is at least the smaller radius times |level - 1|, so the stroke lies between two scaled ellipses
+    scale = margin / max(min(radius_x, radius_y), 1e-9) + 1e-6
+    radius_x, radius_y = max(radius_x, 1e-9), max(radius_y, 1e-9)
+    for band_top, band_bottom in row_bands(pixels, top, bottom):
+        rows = numpy.arange(band_top, band_bottom)
+        if half_width is None:
+            fill_spans(pixels, rows, *ellipse_spans(center_x, center_y, radius_x, radius_y, rows), color)
+            continue
+        starts, ends = ellipse_spans(center_x, center_y, radius_x * (1 + scale), radius_y * (1 + scale), rows)
+        inner_starts, inner_ends = ends, ends
+        if scale < 1:
+            inner_starts, inner_ends = ellipse_spans(center_x, center_y, radius_x * (1 - scale),
+                                                     radius_y * (1 - scale), rows)
+            missed = inner_ends <= inner_starts
+            inner_starts[missed], inner_ends[missed] = ends[missed], ends[missed]
+        owners, columns = spread(numpy.clip(numpy.concatenate((starts, inner_ends)), left, right),
+                                 numpy.clip(numpy.concatenate((inner_starts, ends)), left, right))
+        rows = numpy.concatenate((rows, rows))[owners]
+        stroke = abs(ellipse_distance(columns + 0.5 - center_x, rows + 0.5 - center_y, radius_x, radius_y)) < half_width
+        cells, cell = pixel_cells(pixels, color)
+        cells[rows[stroke], columns[stroke]] = cell
+
+
+def fill_disks(pixels, xs, ys, radius, color):
+    """
+    Sets the pixels whose centers are inside any of the circles of the same radius. Points with the same fractional
+    part cover the same pattern of pixels around them, so it is computed once and stamped at every point
+    :param pixels: BGR array
+    :param xs: x coordinates of the centers
+    :param ys: y coordinates of the centers
+    :param radius:
+    :param color: (b, g, r)
+    :return:
+    """
+
+    import numpy
+
+    xs, ys = numpy.asarray(xs, numpy.float64), numpy.asarray(ys, numpy.float64)
+    if not len(xs) or radius <= 0:
+        return
+    cells, color = pixel_cells(pixels, color)
+    reach = math.ceil(radius) + 1
+    offsets = numpy.arange(-reach, reach + 1)
+    fractions = numpy.stack((xs % 1, ys % 1), axis=1)
+    for fraction_x, fraction_y in numpy.unique(fractions, axis=0):
+        dy, dx = numpy.nonzero((offsets[:, None] + 0.5 - fraction_y) ** 2 + (offsets[None, :] + 0.5 - fraction_x) ** 2
+                               < radius ** 2)
+        dy, dx = dy - reach, dx - reach
+        chosen = (fractions[:, 0] == fraction_x) & (fractions[:, 1] == fraction_y)
+        base_xs, base_ys = numpy.floor(xs[chosen]).astype(numpy.int64), numpy.floor(ys[chosen]).astype(numpy.int64)
+        step = max(1, raster_band_pixels // len(dx))
+        for first in range(0, len(base_xs), step):
+            rows = (base_ys[first:first + step, None] + dy).ravel()
+            columns = (base_xs[first:first + step, None] + dx).ravel()
+            inside = (rows >= 0) & (rows < pixels.shape[0]) & (columns >= 0) & (columns < pixels.shape[1])
+            cells[rows[inside], columns[inside]] = color
+
+
+def rasterize_objects(pixels, database, objects):
+    """
+    Draws rows returned by Database.objects into a BGR array with NumPy, the Qt-free counterpart of paint_objects.
+    Like aliased Qt painting it sets the pixels whose centers are covered, alpha is ignored. It doesn't need a
+    QApplication, so frames can be rasterized on worker threads, each with a Database of its own
+    :param pixels: array of shape (height, width, 3) in project coordinates
+    :param database: Database the rows were read from, it is asked for points of pens and fillers
+    :param objects:
+    :return: count of drawn objects and count of drawn points of pens and fillers
+    """
+
+    points_count = 0
+    for elem in objects:
+        (identifier, frame_id, object_stroke_width, object_color, x, y, xx, yy,
+         object_z_index, object_fill_color, name, object_type) = elem[:12]
+        object_color = color_to_bgr(object_color)
+        if object_type == ellipse:
+            center_x, center_y, radius_x, radius_y = (x + xx) / 2, (y + yy) / 2, abs(xx - x) / 2, abs(yy - y) / 2
+            fill_ellipse(pixels, center_x, center_y, radius_x, radius_y, color_to_bgr(object_fill_color))
+            fill_ellipse(pixels, center_x, center_y, radius_x, radius_y, object_color,
+                         max(1, object_stroke_width) / 2)
+        elif object_type == line:
+            # Qt pens have square caps: the stroke is a rectangle that goes half of its width past both ends
+            half_width = max(1, object_stroke_width) / 2
+            length = math.hypot(xx - x, yy - y)
+            dx, dy = ((xx - x) / length, (yy - y) / length) if length else (1, 0)
+            along_x, along_y, across_x, across_y = dx * half_width, dy * half_width, -dy * half_width, dx * half_width
+            fill_polygon(pixels, (x - along_x + across_x, xx + along_x + across_x, xx + along_x - across_x,
+                                  x - along_x - across_x),
+                         (y - along_y + across_y, yy + along_y + across_y, yy + along_y - across_y,
+                          y - along_y - across_y), object_color)
+        elif object_type == pen:
+            points = database.object_points(identifier, pen)
+            points_count += len(points)
+            fill_disks(pixels, [elem[2] for elem in points], [elem[3] for elem in points], object_stroke_width,
+                       object_color)
+        else:  # filler
+            points = database.object_points(identifier, filler)
+            points_count += len(points)
+            fill_polygon(pixels, [elem[2] for elem in points], [elem[3] for elem in points], object_color)
+    return len(objects), points_count
+
+
+def rasterize_frame(database, frame, pixels):
+    """
+    Rasterizes a frame on white with NumPy
+    :param database:
+    :param frame:
+    :param pixels: array of shape (height, width, 3) to draw into
+    :return: the same array
+    """
+
+    pixels[:] = 255
+    rasterize_objects(pixels, database, database.objects(frame=frame))
+    return pixels
+
+
+def color_to_bgr(value):
+    """
+    :param value: color stored as "r|g|b|a"
+    :return: (b, g, r) tuple
+    """
+
+    red, green, blue = map(int, value.split('|')[:3])
+    return blue, green, red
+
+
+def preview_image(pixels):
+    """
+    Makes a small QImage of a BGR array for the render window without painting anything
+    :param pixels: array of shape (height, width, 3)
+    :return: QImage at most scrub_preview_max_side pixels wide or high
+    """
+
+    import numpy
+
+    step = max(1, -(-max(pixels.shape[:2]) // scrub_preview_max_side))
+    pixels = numpy.ascontiguousarray(pixels[::step, ::step])
+    return QImage(pixels.data, pixels.shape[1], pixels.shape[0], pixels.strides[0], QImage.Format_BGR888).copy()
+
+
+def image_writer_options(image_type, quality):
+    """
+    Translates the setting of the sequence window into the options of both image writers
+    :param image_type: "png", "jpg" or "webp"
+    :param quality: zlib compression level for png, quality for jpg, ignored for lossless webp
+    :return: quality argument of QImage.save and parameters of cv2.imwrite
+    """
+
+    import cv2
+
+    if image_type == "png":
+        # QImage.save turns quality into the compression level as (100 - quality) * 9 / 91
+        return 100 - math.ceil(quality * 91 / 9), [cv2.IMWRITE_PNG_COMPRESSION, quality]
+    if image_type == "jpg":
+        return quality, [cv2.IMWRITE_JPEG_QUALITY, quality]
+    return 100, [cv2.IMWRITE_WEBP_QUALITY, 101]
+
+
+def option_check_box(text, parent):
+    """
+    A check box styled like the labels of the generated render windows
+    :param text:
+    :param parent:
+    :return: QCheckBox
+    """
+
+    check_box = QCheckBox(text, parent)
+    font = QFont()
+    font.setPointSize(16)
+    check_box.setFont(font)
+    check_box.setStyleSheet("color: white;")
+    return check_box
+
+
+def blend_colors(first, last, share):
+    """
+    Linear blend of two colors stored as "r|g|b|a" strings
+    :param share: 0 gives the first color, 1 the last one
+    :return: color string
+    """
+
+    return '|'.join(str(round(a + (b - a) * share)) for a, b in zip(map(int, first.split('|')),
+                                                                     map(int, last.split('|'))))
+
+
+def image_to_bgr(image):
+    """
+    Converts a QImage into the contiguous BGR array cv2 expects, 32-bit Qt pixels are stored as B, G, R, A bytes
+    :param image:
+    :return: numpy array of shape (height, width, 3)
+    """
+
+    import numpy
+
+    image = image.convertToFormat(QImage.Format_RGB32)
+    bits = image.constBits()
+    bits.setsize(image.bytesPerLine() * image.height())
+    pixels = numpy.frombuffer(bits, numpy.uint8).reshape(image.height(), image.bytesPerLine() // 4, 4)
+    return numpy.ascontiguousarray(pixels[:, :image.width(), :3])
+
+
 # constants
 valid_characters = "abcdefghijklmnopqrstuvwxyz0123456789"
-useless_time_offset_ms = 1000
 with open(resource_path("texts/style.csv"), 'r') as file:
     style = list(csv.DictReader(file, delimiter=','))
 timeline_constant_step = 50
 timeline_label_width = 40
+timeline_height = 40
+thumbnail_height = 36
+thumbnail_request_delay_ms = 200
+thumbnail_cache_size = 512
+thumbnail_files_limit = 4096
 canvas_size_limit = 200
+spatial_index_cell_size = 128
+zoom_pyramid_levels = 4
+zoom_pyramid_max_side = 4096
+zoom_settle_ms = 150
+onion_range_limit = 10
+onion_opacity = 0.3
+onion_before_tint = (200, 40, 40)
+onion_after_tint = (40, 150, 40)
+onion_cache_max_side = 2048
+onion_cache_size = 2 * onion_range_limit + 2
+recent_projects_directory = os.environ.get("PAINTMATE_RECENT_PROJECTS") or os.path.join(os.path.expanduser("~"),
+                                                                                        ".paintmate")
+recent_projects_limit = 10
+recent_thumbnail_height = 72
+sql_trace_window = 2000
+sql_trace_refresh_ms = 500
+performance_log_size = 1000
+performance_fps_window = 24
+latency_samples = 1000
+latency_complexity_buckets = (50, 200, 500, 1000)
+latency_budget_ms = 16
+scrub_preview_max_side = 480
+scrub_cache_size = 256
+render_manifest_name = "manifest.json"
+raw_frame_cache_limit = 2 * 1024 ** 3
+frame_store_name = "frames.npy"
+render_tile_size = 1024
+raster_band_pixels = 2 ** 20
+rasterizer_threads = os.cpu_count() or 1
+rasterizer_queue = 2 * rasterizer_threads
+# with fewer threads the NumPy rasterizer is slower than Qt painting, so it isn't offered
+numpy_rasterizer_min_threads = 4
+sequence_encoder_threads = os.cpu_count() or 1
+sequence_encoder_queue = 2 * sequence_encoder_threads
+# image type: (setting label, lowest, highest, default), webp is always lossless
+image_quality_ranges = {"png": ("Сжатие PNG", 0, 9, 6), "jpg": ("Качество JPEG", 0, 100, 95)}
+video_segments = os.cpu_count() or 1
+mjpg_quality = 95
+# AVI 1.0 sizes are 32-bit, larger stitched videos are encoded by a single cv2.VideoWriter
+avi_size_limit = 2 ** 32 - 2 ** 24
+qt_rasterizer = "Qt"
+numpy_rasterizer = "NumPy"
+tiled_render_min_pixels = 4096 * 4096
+exposure_limit = 100
+# frames take revisions from one counter of the project, so a frame number never gets a revision it had before
+project_revision = "(SELECT revision FROM setting)"
+hit_tolerance = 4
 # saveable settings
 fps = "fps"
 current_frame = "current_frame"
@@ -58,6 +544,8 @@ stroke_width = "stroke_width"
 color = "color"
 fill_color = "fill_color"
 ghost = "ghost"
+onion_before = "onion_before"
+onion_after = "onion_after"
 # tools
 manipulator = "manipulator"
 pen = "pen"
@@ -93,7 +581,6 @@ class Paintmate(QMainWindow, DeviceInfo, ProjectWindowUi.Ui_MainWindow):
     def __init__(self):
         super().__init__()
         self.loading_window = LoadingWindow()
-        self.loading_window.show()
         self.choose_project_window = None
         self.canvas = None
         self.about_window = None
@@ -105,10 +592,16 @@ class Paintmate(QMainWindow, DeviceInfo, ProjectWindowUi.Ui_MainWindow):
         self.frame_for_copying = 1
         self.database = Database()
         self.current_tool = manipulator
-        QTimer.singleShot(useless_time_offset_ms, self.open_select_project_window)
+        self.objects_model = None
+        self.objects_list = None
+        self.selected_object = None
+        self.thumbnail_strip = None
+        self.recent_projects = RecentProjects()
+        self.sql_trace_window = None
+        self.loading_window.show_then(self.open_select_project_window)
 
     def open_select_project_window(self):
-        self.choose_project_window = ChooseProjectWindow(self.open_project, self.create_project)
+        self.choose_project_window = ChooseProjectWindow(self.open_project, self.create_project, self.recent_projects)
         self.choose_project_window.show()
         self.loading_window.hide()
 
@@ -133,20 +626,24 @@ class Paintmate(QMainWindow, DeviceInfo, ProjectWindowUi.Ui_MainWindow):
         ok = input_window.exec()
         name = input_window.textValue()
         if ok and self.check_input(name, "sqlite"):
-            self.open_project(name + ".sqlite")
+            self.open_project(name + ".sqlite", True)
 
-    def open_project(self, database_file=None):
+    def open_project(self, database_file=None, create=False):
         if not database_file:
             database_file = QFileDialog.getOpenFileName(self, "Выберите данные проекта", '')[0]
             if not database_file:
                 return
-            self.database.connect(database_file)
-        else:
-            self.database.connect(database_file)
+        elif not create and not os.path.exists(database_file):
+            self.warning("Проект не найден")
+            return
+        self.database.connect(database_file)
+        if create:
             self.database.populate()
-        self.loading_window.show()
+        else:
+            self.database.migrate()
+        self.recent_projects.remember(database_file)
         self.choose_project_window.hide()
-        QTimer.singleShot(useless_time_offset_ms, self.init_ui)
+        self.loading_window.show_then(self.init_ui)
 
     def init_ui(self):
         self.setupUi(self)
@@ -162,18 +659,38 @@ class Paintmate(QMainWindow, DeviceInfo, ProjectWindowUi.Ui_MainWindow):
         self.render_animation_window = RenderAnimationWindow(self)
         self.render_sequence_window = RenderSequenceWindow(self)
         self.canvas = Canvas(self)
+        self.timeline = Timeline(self.centralwidget)
+        timeline_container = QWidget(self.centralwidget)
+        timeline_layout = QVBoxLayout(timeline_container)
+        timeline_layout.setContentsMargins(0, 0, 0, 0)
+        timeline_layout.addWidget(self.timeline)
+        self.thumbnail_strip = ThumbnailStrip(self.timeline, self.database, timeline_container)
+        timeline_layout.addWidget(self.thumbnail_strip)
+        timeline_layout.addWidget(self.timeline.scroll_bar)
+        self.gridLayout.replaceWidget(self.scrollArea, timeline_container)
+        self.scrollArea.deleteLater()
+        self.objects_model = ObjectsModel()
+        self.objects_list = QListView(self.objects_area_layout_widget)
+        self.objects_list.setModel(self.objects_model)
+        self.objects_list.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.objects_list.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.objects_list.setUniformItemSizes(True)
+        self.objects_area_layout.addWidget(self.objects_list)
         self.position_to_center()
         self.update_timeline()
+        self.update_objects_list()
         self.pencil_tool.clicked.connect(lambda: self.change_tool(pen))
         self.line_tool.clicked.connect(lambda: self.change_tool(line))
         self.ellipse_tool.clicked.connect(lambda: self.change_tool(ellipse))
         self.fill_tool.clicked.connect(lambda: self.change_tool(filler))
-        self.radio_group.buttonClicked.connect(lambda: self.change_tool(manipulator))
+        self.objects_list.selectionModel().selectionChanged.connect(self.change_selected_object)
+        self.objects_list.clicked.connect(lambda: self.change_tool(manipulator))
         self.radioButton.hide()
         self.create_frame.clicked.connect(self.create_new_frame)
         self.timeline_visual_multiplier.valueChanged.connect(
             lambda: self.update_timeline(self.timeline_visual_multiplier.value()))
         self.timeline.valueChanged.connect(self.change_current_frame)
+        self.timeline.sliderReleased.connect(self.change_current_frame)
         self.current_frame.valueChanged.connect(self.change_current_frame)
         self.frame_rate.valueChanged.connect(self.change_fps)
         self.copy_frame.clicked.connect(lambda: self.change_frame_for_copying(self.timeline.value()))
@@ -206,7 +723,26 @@ class Paintmate(QMainWindow, DeviceInfo, ProjectWindowUi.Ui_MainWindow):
         self.set_ghost.triggered.connect(lambda: self.database.update_settings(ghost=(1 if self.set_ghost.isChecked()
                                                                                       else 0)))
         self.set_ghost.setChecked(bool(self.database.settings[ghost]))
+        self.set_ghost.triggered.connect(self.canvas.invalidate_cache)
         self.set_ghost.triggered.connect(self.canvas.repaint)
+        self.set_onion_before = self.canvas_window.addAction("Кадров до в кальке")
+        self.set_onion_before.triggered.connect(lambda: self.change_onion_range(onion_before))
+        self.set_onion_after = self.canvas_window.addAction("Кадров после в кальке")
+        self.set_onion_after.triggered.connect(lambda: self.change_onion_range(onion_after))
+        self.set_frame_exposure = self.canvas_window.addAction("Длительность кадра")
+        self.set_frame_exposure.triggered.connect(self.change_frame_exposure)
+        self.set_keyframe = self.canvas_window.addAction("Ключевой кадр объекта")
+        self.set_keyframe.triggered.connect(self.add_keyframe)
+        self.show_performance = self.canvas_window.addAction("Показатели производительности")
+        self.show_performance.setCheckable(True)
+        self.show_performance.toggled.connect(self.toggle_performance_hud)
+        self.save_performance = self.canvas_window.addAction("Сохранить показатели в CSV")
+        self.save_performance.triggered.connect(self.save_performance_log)
+        self.save_latency = self.canvas_window.addAction("Сохранить задержки ввода")
+        self.save_latency.triggered.connect(self.save_latency_report)
+        self.trace_sql = self.help_window.addAction("Отладка SQL")
+        self.trace_sql.setCheckable(True)
+        self.trace_sql.toggled.connect(self.toggle_sql_trace)
         # show
         self.canvas.show()
         self.show()
@@ -219,8 +755,12 @@ class Paintmate(QMainWindow, DeviceInfo, ProjectWindowUi.Ui_MainWindow):
         """
 
         self.hide()
+        self.thumbnail_strip.close_worker()
+        if self.sql_trace_window is not None:
+            # the panel shows the trace of the closed project's Database, the new one makes its own
+            self.sql_trace_window.deleteLater()
+        self.sql_trace_window = None
         self.loading_window = LoadingWindow()
-        self.loading_window.show()
         self.choose_project_window = None
         self.canvas = None
         self.change_object_window = None
@@ -232,7 +772,11 @@ class Paintmate(QMainWindow, DeviceInfo, ProjectWindowUi.Ui_MainWindow):
         self.frame_for_copying = 1
         self.database = Database()
         self.current_tool = manipulator
-        QTimer.singleShot(useless_time_offset_ms, self.open_select_project_window)
+        self.objects_model = None
+        self.objects_list = None
+        self.selected_object = None
+        self.thumbnail_strip = None
+        self.loading_window.show_then(self.open_select_project_window)
 
     def create_new_frame(self):
         self.database.update_settings(current_frame=self.database.settings[count_of_frames] + 1)
@@ -247,6 +791,8 @@ class Paintmate(QMainWindow, DeviceInfo, ProjectWindowUi.Ui_MainWindow):
             self.database.update_settings(width=QInputDialog.getInt(self, "Холст", "Ширина", 1920, 100, 16384))
         else:
             self.database.update_settings(height=QInputDialog.getInt(self, "Холст", "Высота", 1920, 100, 16384))
+        # cached rasters keep the aspect ratio of the old size
+        self.invalidate_frames()
         self.canvas.hand_resize(self.database.settings[width], self.database.settings[height])
 
     def change_default_color(self, parameter):
@@ -271,6 +817,95 @@ class Paintmate(QMainWindow, DeviceInfo, ProjectWindowUi.Ui_MainWindow):
                 self.database.update_settings(fill_color=col)
         color_window.deleteLater()
 
+    def invalidate_frames(self, frame=None):
+        """
+        Tells every per-frame cache that a frame was edited, or that all frames were shifted when frame is None.
+        Editing a keyframe changes the in-betweens around it, so then all frames are invalidated
+        :param frame:
+        :return:
+        """
+
+        if frame is not None and self.database.is_tweened(frame):
+            frame = None
+        self.canvas.invalidate_rasters(frame)
+        self.thumbnail_strip.invalidate(frame)
+
+    def change_onion_range(self, parameter):
+        """
+        Asks how many frames before or after the current one are shown as onion skin
+        :param parameter: "onion_before" or "onion_after" strings
+        :return:
+        """
+
+        self.database.update_settings(**{parameter: QInputDialog.getInt(
+            self, "Калька", "Кадров до" if parameter == onion_before else "Кадров после",
+            self.database.settings[parameter], 0, onion_range_limit)})
+        self.canvas.invalidate_cache()
+        self.canvas.repaint()
+
+    def change_frame_exposure(self):
+        """
+        Asks how many output frames the current frame is held for, a held drawing is stored once
+        :return:
+        """
+
+        exposure, accepted = QInputDialog.getInt(
+            self, "Длительность кадра", "Кадров вывода",
+            self.database.frame_exposure(self.database.settings[current_frame]), 1, exposure_limit)
+        if accepted:
+            self.database.set_frame_exposure(self.database.settings[current_frame], exposure)
+            self.update_timeline()
+
+    def toggle_performance_hud(self, enabled):
+        self.canvas.monitor.enabled = enabled
+        self.database.set_counting(enabled)
+        self.canvas.repaint()
+
+    def save_performance_log(self):
+        path = QFileDialog.getSaveFileName(self, "Сохранить показатели", "performance.csv", "CSV (*.csv)")[0]
+        if path:
+            self.canvas.monitor.save_csv(path)
+
+    def save_latency_report(self):
+        path = QFileDialog.getSaveFileName(self, "Сохранить задержки ввода", "latency.json", "JSON (*.json)")[0]
+        if path:
+            self.canvas.monitor.save_latency_report(path)
+
+    def toggle_sql_trace(self, enabled):
+        """
+        Turns the SQL instrumentation of the open project on or off and shows its debug panel
+        :param enabled:
+        :return:
+        """
+
+        self.database.set_tracing(enabled)
+        if enabled:
+            self.sql_trace_window = SqlTraceWindow(self.database)
+            self.sql_trace_window.show()
+        elif self.sql_trace_window:
+            self.sql_trace_window.hide()
+
+    def add_keyframe(self):
+        """
+        Copies the selected line or ellipse to another frame as its keyframe, the frames between keyframes show
+        interpolated in-betweens that are not stored
+        :return:
+        """
+
+        if not self.selected_object or self.selected_object[0] not in (line, ellipse):
+            self.warning("Ключевые кадры есть\nтолько у линий и эллипсов")
+            return
+        keyframe, accepted = QInputDialog.getInt(
+            self, "Ключевой кадр", "Кадр", min(self.database.settings[current_frame] + 1,
+                                               self.database.settings[count_of_frames]),
+            1, self.database.settings[count_of_frames])
+        if not accepted or keyframe == self.database.settings[current_frame]:
+            return
+        self.database.add_keyframe(*self.selected_object, keyframe)
+        self.invalidate_frames()
+        self.canvas.invalidate_cache()
+        self.canvas.repaint()
+
     def change_object_info(self, new_name=None, new_stroke_width=None, new_stroke_color=None, new_filler_color=None):
         """
         This function executes the custom window for changing properties of a seleted from frame objects area database
@@ -282,27 +917,26 @@ class Paintmate(QMainWindow, DeviceInfo, ProjectWindowUi.Ui_MainWindow):
         :return:
         """
 
-        for elem in self.radio_group.buttons()[1:]:
-            if elem.isChecked():
-                if not (new_name or new_stroke_width or new_stroke_color or new_filler_color):
-                    self.change_object_window = ChangeObjectWindow(self.change_object_info, self.database.get_object_poperties(elem.text()))
-                else:
-                    self.database.set_object_properties(elem.text(), new_name, new_stroke_width, new_stroke_color,
-                                                        new_filler_color)
-                    for el in self.radio_group.buttons()[1:]:
-                        el.deleteLater()
-                    self.canvas.repaint()
-                    break
+        if not self.selected_object:
+            return
+        if not (new_name or new_stroke_width or new_stroke_color or new_filler_color):
+            self.change_object_window = ChangeObjectWindow(self.change_object_info,
+                                                           self.database.get_object_poperties(*self.selected_object))
+        else:
+            self.database.set_object_properties(*self.selected_object, new_name, new_stroke_width, new_stroke_color,
+                                                new_filler_color)
+            self.invalidate_frames(self.database.settings[current_frame])
+            self.update_objects_list()
+            self.canvas.repaint()
 
     def delete_selected_object(self):
-        for elem in self.radio_group.buttons()[1:]:
-            if elem.isChecked():
-                self.database.remove_object(elem.text())
-                for el in self.radio_group.buttons()[1:]:
-                    el.deleteLater()
-                    self.radio_group.removeButton(el)
-                self.canvas.repaint()
-                break
+        if not self.selected_object:
+            return
+        self.database.remove_object(*self.selected_object)
+        self.selected_object = None
+        self.invalidate_frames(self.database.settings[current_frame])
+        self.update_objects_list()
+        self.canvas.repaint()
 
     def lift(self, addition):
         """
@@ -311,27 +945,30 @@ class Paintmate(QMainWindow, DeviceInfo, ProjectWindowUi.Ui_MainWindow):
         :return:
         """
 
-        for elem in self.radio_group.buttons()[1:]:
-            if elem.isChecked():
-                self.database.set_z_index(elem.text(), addition)
-        self.repaint()
+        if not self.selected_object:
+            return
+        self.database.set_z_index(*self.selected_object, addition)
+        self.invalidate_frames(self.database.settings[current_frame])
+        self.update_objects_list()
+        self.canvas.repaint()
 
     def paste_copied_frame_after(self, frame):
         self.database.duplicate_frame(self.frame_for_copying, frame)
+        self.invalidate_frames()
         self.create_new_frame()
         self.current_frame.setValue(frame + 1)
 
     def delete_current_frame(self):
-        if self.timeline.value() != self.timeline.maximum():
-            for elem in self.radio_group.buttons()[1:]:
-                elem.deleteLater()
         self.database.delete_frame(self.timeline.value())
+        self.invalidate_frames()
         self.update_timeline()
+        self.update_objects_list()
         self.canvas.repaint()
 
     def change_current_frame(self):
         """
-        This function generally switches frames
+        This function generally switches frames. While the timeline slider is held only a low-resolution preview
+        is shown, the frame is saved and painted exactly once the slider is released
         :return:
         """
 
@@ -346,9 +983,12 @@ class Paintmate(QMainWindow, DeviceInfo, ProjectWindowUi.Ui_MainWindow):
                 self.timeline.setValue(self.sender().value())
             return
         self.current_frame.setValue(self.timeline.value())
+        if self.timeline.isSliderDown():
+            self.canvas.scrub(self.timeline.value())
+            return
+        self.canvas.scrub_frame = None
         self.database.update_settings(current_frame=self.timeline.value())
-        for elem in self.radio_group.buttons()[1:]:
-            elem.deleteLater()
+        self.update_objects_list()
         self.canvas.repaint()
 
     def to_first_frame(self):
@@ -382,16 +1022,42 @@ class Paintmate(QMainWindow, DeviceInfo, ProjectWindowUi.Ui_MainWindow):
 
         self.current_tool = tool
 
+    def update_objects_list(self):
+        """
+        Refills the objects area model from a snapshot of the current frame and restores the selection by object id
+        :return:
+        """
+
+        selected_object = self.selected_object
+        objects = [elem for elem in self.database.objects() if elem[0] > 0]
+        self.objects_model.reload(objects)
+        self.database.index_frame(objects)
+        self.canvas.invalidate_cache()
+        self.selected_object = None
+        self.select_object(selected_object)
+
+    def select_object(self, key):
+        row = self.objects_model.row_of(key)
+        if row is not None:
+            self.objects_list.setCurrentIndex(self.objects_model.index(row))
+
+    def change_selected_object(self):
+        indexes = self.objects_list.selectionModel().selectedIndexes()
+        self.selected_object = indexes[0].data(Qt.UserRole) if indexes else None
+
     def playing(self, signal=None):
         if signal:
             self.now_playing = not self.now_playing
             if self.now_playing:
+                self.canvas.monitor.reset_playback()
                 self.objects_area_layout_widget.hide()
             else:
                 self.objects_area_layout_widget.show()
         if self.now_playing:
+            self.canvas.monitor.record_step(self.database.frame_exposure(self.database.settings[current_frame]))
             self.to_next_frame()
-            QTimer.singleShot(int(1 / self.frame_rate.value() * 1000), self.playing)
+            QTimer.singleShot(int(self.database.frame_exposure(self.database.settings[current_frame]) /
+                                  self.frame_rate.value() * 1000), self.playing)
 
     def update_timeline(self, value=None):
         """
@@ -405,31 +1071,11 @@ class Paintmate(QMainWindow, DeviceInfo, ProjectWindowUi.Ui_MainWindow):
                 ' '.join(self.timeline_visual_multiplier_description.text().split()[:2]) + f" {value}%")
             self.database.update_settings(timeline_multiplier=value)
         self.database.load_settings()
-        frames = list(range(1, self.database.settings[count_of_frames] + 1))
-        self.timeline.setMaximum(len(frames))
-        timeline_step = int(timeline_constant_step * self.database.settings[timeline_multiplier] / 100)
-        self.timeline.setFixedWidth(timeline_step * (len(frames) - 1 if len(frames) - 1 else 1))
-        self.ruler.setFixedWidth(self.timeline.width() + timeline_label_width)
-        self.timeline.setFixedWidth(13 + self.timeline.width())
+        self.timeline.setMaximum(self.database.settings[count_of_frames])
+        self.timeline.set_exposures(self.database.exposures())
+        self.current_frame.setMaximum(max(self.current_frame.maximum(), self.database.settings[count_of_frames]))
+        self.timeline.set_step(int(timeline_constant_step * self.database.settings[timeline_multiplier] / 100))
         self.timeline.setValue(self.database.settings[current_frame])
-        chunk_width = self.timeline.width() / ((len(frames) - 1) if len(frames) - 1 else 1)
-        while chunk_width < timeline_label_width:
-            frames = frames[::2]
-            try:
-                chunk_width = self.timeline.width() / (len(frames) - 1)
-            except ZeroDivisionError:
-                break
-        font = QFont()
-        font.setPointSize(10)
-        for elem in self.ruler.children():
-            elem.deleteLater()
-        for i in frames:
-            label = QLabel(str(i), self.ruler)
-            label.show()
-            label.setFixedWidth(timeline_label_width)
-            label.setFixedHeight(16)
-            label.setFont(font)
-            label.move(timeline_step * (i - 1), 0)
 
     def warning(self, message):
         """
@@ -450,6 +1096,8 @@ class LoadingWindow(QWidget, DeviceInfo):
     Decorative class for displaying image while loading
     """
 
+    painted = pyqtSignal()
+
     def __init__(self):
         super().__init__()
         self.loading_picture = QPixmap(resource_path("images/loading.png"))
@@ -459,6 +1107,70 @@ class LoadingWindow(QWidget, DeviceInfo):
         self.label = QLabel(self)
         self.label.setPixmap(self.loading_picture)
 
+    def show_then(self, callback):
+        """
+        Shows the window and calls back from the event loop once it is on the screen, so the slow work that follows
+        doesn't leave the user without a picture
+        :param callback:
+        :return:
+        """
+
+        def ready():
+            self.painted.disconnect(ready)
+            QTimer.singleShot(0, callback)
+
+        self.painted.connect(ready)
+        self.show()
+        self.update()
+
+    def paintEvent(self, event):
+        self.painted.emit()
+
+
+class SqlTraceWindow(QWidget, DeviceInfo):
+    """
+    Debug panel with the rolling SQL summary of the open project, refreshed while it is shown
+    """
+
+    def __init__(self, database):
+        super().__init__()
+        self.database = database
+        self.setWindowTitle("Отладка SQL")
+        self.setMinimumSize(640, 360)
+        self.summary = QLabel(self)
+        self.summary.setFont(QFont("monospace"))
+        self.summary.setAlignment(Qt.AlignLeft | Qt.AlignTop)
+        self.dump_button = QPushButton("Сохранить JSON", self)
+        self.dump_button.clicked.connect(self.dump)
+        layout = QVBoxLayout(self)
+        layout.addWidget(self.summary)
+        layout.addWidget(self.dump_button)
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.timeout.connect(self.refresh)
+        self.position_to_center()
+
+    def showEvent(self, event):
+        self.refresh()
+        self.refresh_timer.start(sql_trace_refresh_ms)
+
+    def hideEvent(self, event):
+        self.refresh_timer.stop()
+
+    def refresh(self):
+        if self.database.trace is None:
+            self.summary.setText("Трассировка выключена")
+            return
+        lines = [f"{'метод':<28}{'вызовы':>8}{'запросы':>9}{'на вызов':>10}{'коммиты':>9}{'мс':>10}"]
+        for site, elem in sorted(self.database.trace.summary().items(), key=lambda item: -item[1]["milliseconds"]):
+            lines.append(f"{site:<28}{elem['calls']:>8}{elem['statements']:>9}{elem['statements_per_call']:>10.1f}"
+                         f"{elem['commits']:>9}{elem['milliseconds']:>10.1f}")
+        self.summary.setText('\n'.join(lines))
+
+    def dump(self):
+        path = QFileDialog.getSaveFileName(self, "Сохранить трассировку", "sql_trace.json", "JSON (*.json)")[0]
+        if path and self.database.trace is not None:
+            self.database.trace.dump(path)
+
 
 class AboutWindow(QWidget, DeviceInfo, AboutProgramUi.Ui_Form):
     """
@@ -483,6 +1195,13 @@ class RenderAnimationWindow(QWidget, DeviceInfo, RenderAnimationUi.Ui_Form):
         self.position_to_center()
         self.cancel_button.clicked.connect(self.hide)
         self.render_button.clicked.connect(self.start)
+        self.use_frame_store = option_check_box("Кадры из хранилища, без повторной отрисовки", self)
+        self.use_numpy_rasterizer = option_check_box("Растеризация NumPy вместо Qt", self)
+        self.use_segments = option_check_box("Параллельное кодирование сегментами", self)
+        self.options_layout.addWidget(self.use_frame_store, 0, Qt.AlignCenter)
+        self.options_layout.addWidget(self.use_numpy_rasterizer, 0, Qt.AlignCenter)
+        self.options_layout.addWidget(self.use_segments, 0, Qt.AlignCenter)
+        self.use_numpy_rasterizer.setVisible(rasterizer_threads >= numpy_rasterizer_min_threads)
 
     def start(self):
         if self.codec.currentText() == "VP9" and self.container.currentText() == "avi":
@@ -491,10 +1210,16 @@ class RenderAnimationWindow(QWidget, DeviceInfo, RenderAnimationUi.Ui_Form):
             self.paintmate.warning("Контейнер mp4\nНе пожжерживает YUY2")
         elif self.codec.currentText() == "MJPG" and self.container.currentText() == "mp4":
             self.paintmate.warning("Контейнер mp4\nНе пожжерживает MJPG")
+        elif self.use_segments.isChecked() and self.codec.currentText() != "MJPG":
+            self.paintmate.warning("Кодирование сегментами\nДоступно только для MJPG в avi")
         elif self.paintmate.check_input(self.file_name.text(), self.container.currentText()):
             self.paintmate.render_window = PaintmateRender(self.file_name.text() + f".{self.container.currentText()}",
                                                            False,
-                                                           self.paintmate, self.codec.currentText())
+                                                           self.paintmate, self.codec.currentText(),
+                                                           self.use_frame_store.isChecked(),
+                                                           numpy_rasterizer if self.use_numpy_rasterizer.isChecked()
+                                                           else qt_rasterizer,
+                                                           segmented=self.use_segments.isChecked())
             self.hide()
 
 
@@ -506,11 +1231,39 @@ class RenderSequenceWindow(QWidget, DeviceInfo, RenderSequenceUi.Ui_Form):
         self.position_to_center()
         self.cancel_button.clicked.connect(self.hide)
         self.render_button.clicked.connect(self.start)
+        self.use_numpy_rasterizer = option_check_box("Растеризация NumPy вместо Qt", self)
+        self.type.addItem("webp")
+        font = QFont()
+        font.setPointSize(16)
+        self.quality_label = QLabel(self)
+        self.quality_label.setFont(font)
+        self.quality_label.setStyleSheet("color: white;")
+        self.quality = QSpinBox(self)
+        self.quality.setFont(font)
+        self.quality.setStyleSheet("color: white;")
+        quality_layout = QHBoxLayout()
+        quality_layout.addWidget(self.quality_label)
+        quality_layout.addWidget(self.quality)
+        self.options_layout.addWidget(self.use_numpy_rasterizer, 0, Qt.AlignCenter)
+        self.options_layout.addLayout(quality_layout)
+        self.use_numpy_rasterizer.setVisible(rasterizer_threads >= numpy_rasterizer_min_threads)
+        self.type.currentTextChanged.connect(self.change_type)
+        self.change_type(self.type.currentText())
+
+    def change_type(self, image_type):
+        label, lowest, highest, default = image_quality_ranges.get(image_type, ("WebP без потерь", 0, 0, 0))
+        self.quality_label.setText(label)
+        self.quality.setRange(lowest, highest)
+        self.quality.setValue(default)
+        self.quality.setEnabled(image_type in image_quality_ranges)
 
     def start(self):
         if self.paintmate.check_input(self.file_name.text(), ''):
             self.paintmate.render_window = PaintmateRender(self.file_name.text(), True,
-                                                           self.paintmate, self.type.currentText())
+                                                           self.paintmate, self.type.currentText(),
+                                                           rasterizer=numpy_rasterizer
+                                                           if self.use_numpy_rasterizer.isChecked() else qt_rasterizer,
+                                                           image_quality=self.quality.value())
             self.hide()
 
 
@@ -519,29 +1272,92 @@ class PaintmateRender(QWidget, DeviceInfo, PaintmateRenderWindowUi.Ui_Form):
     The async renderer with its own window, uses daemon threading for numpy and video encoding operations (produce_2)
     """
 
-    def __init__(self, object_name, is_sequence, paintmate, codec):
+    def __init__(self, object_name, is_sequence, paintmate, codec, use_frame_store=False, rasterizer=qt_rasterizer,
+                 image_quality=None, segmented=False):
+        """
+        :param object_name: video file or directory of the image sequence
+        :param is_sequence:
+        :param paintmate:
+        :param codec: video codec or image type
+        :param use_frame_store: videos take frames from the project FrameStore and paint only the missing ones
+        :param rasterizer: qt_rasterizer or numpy_rasterizer
+        :param image_quality: png compression level or jpg quality of a sequence, the image_quality_ranges default
+        :param segmented: an MJPG video is encoded in video_segments parallel segments which are stitched into avi
+        """
+
         super().__init__()
         self.object_name, self.is_sequence, self.paintmate, self.codec = object_name, is_sequence, paintmate, codec
-        self.paintmate.loading_window.show()
+        self.rasterizer = rasterizer
+        # frames of different rasterizers differ slightly, so they are cached apart
+        self.raw_suffix = '' if rasterizer == qt_rasterizer else f"_{rasterizer.lower()}"
+        self.is_tiled = self.paintmate.database.settings[width] * self.paintmate.database.settings[height] \
+            > tiled_render_min_pixels
         self.start_time_value = datetime.datetime.now()
         self.start_frame_time_value = self.start_time_value
         self.frames = int()
-        if not is_sequence:
-            self.video = cv2.VideoWriter(self.object_name, cv2.VideoWriter.fourcc(*{
-                "h264": "MP4V",
-                "VP9": "VP9 ",
-                "Motion JPG": "MJPG",
-                "YUY2": "YUY2"
-            }[codec]), self.paintmate.database.settings[fps],
-                                         (self.paintmate.database.settings[width],
-                                          self.paintmate.database.settings[height]))
-        QTimer.singleShot(useless_time_offset_ms, self.init_ui)
+        self.reused_frames = int()
+        self.held_frames = int()
+        self.last_pixels = None
+        self.image_quality = None
+        self.failed_frames = int()
+        self.segmented = segmented and codec == "MJPG" and not is_sequence
+        self.frame_sources = list()
+        self.video = None
+        self.encoder = None
+        self.encoder_slots = threading.BoundedSemaphore(sequence_encoder_queue)
+        self.encoded = dict()
+        self.rasterizer_pool = None
+        self.rasterizer_slots = threading.BoundedSemaphore(rasterizer_queue)
+        self.worker_databases = queue.Queue()
+        self.rasterized = list()
+        self.last_task = None
+        self.queued_frames = deque()
+        if rasterizer == numpy_rasterizer:
+            self.rasterizer_pool = ThreadPoolExecutor(rasterizer_threads)
+            for _ in range(rasterizer_threads):
+                # Database is a DeviceInfo, so the connections of the pool tasks are made here, on the GUI thread
+                database = Database()
+                database.connect(self.paintmate.database.database_file)
+                self.worker_databases.put(database)
+        if is_sequence:
+            self.image_quality = image_quality if image_quality is not None \
+                else image_quality_ranges.get(codec, (None, 0, 0, 0))[3]
+            self.qt_quality, self.cv_parameters = image_writer_options(codec, self.image_quality)
+            self.encoder = ThreadPoolExecutor(sequence_encoder_threads)
+        # a video is encoded again as a whole, only sequences keep unchanged frame files
+        self.manifest_path = os.path.join(object_name, render_manifest_name)
+        self.previous_hashes = self.load_manifest() if is_sequence else list()
+        self.frame_hashes = list()
+        self.exposures = list()
+        self.frame_store = None
+        if use_frame_store and not is_sequence:
+            self.frame_store = FrameStore(self.paintmate.database.cache_directory("store"),
+                                          self.paintmate.database.settings[width],
+                                          self.paintmate.database.settings[height])
+        if not is_sequence and not self.segmented:
+            self.video = self.video_writer()
+        self.paintmate.loading_window.show_then(self.init_ui)
+
+    def video_writer(self):
+        import cv2
+
+        return cv2.VideoWriter(self.object_name, cv2.VideoWriter.fourcc(*{
+            "h264": "MP4V",
+            "VP9": "VP9 ",
+            "MJPG": "MJPG",
+            "YUY2": "YUY2"
+        }[self.codec]), self.paintmate.database.settings[fps],
+                               (self.paintmate.database.settings[width], self.paintmate.database.settings[height]))
 
     def init_ui(self):
         self.paintmate.database.load_settings()
         self.setupUi(self)
         self.setWindowTitle("Paintmate рендер")
         self.total_frame.setText(str(self.paintmate.database.settings[count_of_frames]))
+        self.exposures = self.paintmate.database.exposures()
+        if self.frame_store is not None:
+            self.frame_store.open(self.paintmate.database.frame_hash(frame) + self.raw_suffix
+                                  for frame in range(1, self.paintmate.database.settings[count_of_frames] + 1))
         self.paintmate.hide()
         self.show()
         self.paintmate.to_first_frame()
@@ -556,57 +1372,401 @@ class PaintmateRender(QWidget, DeviceInfo, PaintmateRenderWindowUi.Ui_Form):
         self.start_frame_time_value = datetime.datetime.now()
         threading.Thread(target=self.produce_2, daemon=True).start()
 
+    def load_manifest(self):
+        """
+        Reads frame hashes written by the previous render into the same output, they are ignored when the project
+        resolution or the image type has changed since then
+        :return: list of hex digests, one per frame
+        """
+
+        try:
+            with open(self.manifest_path, 'r') as manifest_file:
+                manifest = json.load(manifest_file)
+        except (OSError, ValueError):
+            return list()
+        if manifest.get("size") != [self.paintmate.database.settings[width], self.paintmate.database.settings[height]] \
+                or manifest.get("codec") != self.codec or manifest.get("rasterizer", qt_rasterizer) != self.rasterizer \
+                or manifest.get("quality") != self.image_quality:
+            return list()
+        return manifest.get("frames", list())
+
+    def save_manifest(self):
+        with open(self.manifest_path, 'w') as manifest_file:
+            json.dump({"size": [self.paintmate.database.settings[width], self.paintmate.database.settings[height]],
+                       "codec": self.codec, "rasterizer": self.rasterizer, "quality": self.image_quality,
+                       "frames": self.frame_hashes}, manifest_file)
+
     def produce_2(self):
-        image = self.paintmate.canvas.render_self()
-        if not self.is_sequence:
-            pixels = list()
-            for i in range(self.paintmate.database.settings[height]):
-                pixel_row = list()
-                for j in range(self.paintmate.database.settings[width]):
-                    pixel_row.append(((pixel_color := image.pixelColor(j, i)).red(), pixel_color.green(),
-                                      pixel_color.blue()))
-                pixels.append(pixel_row)
-            pixels = numpy.array(pixels).astype("uint8")
-            self.video.write(pixels)
-        else:
-            if self.object_name not in os.listdir():
-                os.mkdir(os.getcwd() + f"\\{self.object_name}")
-            image.save(f"{self.object_name}/{self.frames}.{self.codec}")
+        """
+        Renders the next frame only if its content has changed and emits it as many times as it is exposed: a frame
+        identical to the previous one (a hold) reuses its converted buffer or file, sequences keep the files written
+        by the previous render, videos take raw frames from the project cache keyed by the frame content hash.
+        Canvases larger than tiled_render_min_pixels are painted in tiles straight into a memory-mapped raw frame,
+        so memory use depends on the tile size and not on the canvas size
+        :return:
+        """
+
+        import numpy
+
+        frame = self.frames + 1
+        content_hash = self.paintmate.database.frame_hash(frame)
+        raw_key = content_hash + self.raw_suffix
+        project_width = self.paintmate.database.settings[width]
+        project_height = self.paintmate.database.settings[height]
+        raw_frame = os.path.join(self.paintmate.database.cache_directory("frames"),
+                                 f"{content_hash}_{project_width}x{project_height}{self.raw_suffix}.npy")
+        image = None
+        for _ in range(self.exposures[self.frames]):
+            index = len(self.frame_hashes)
+            is_held = bool(self.frame_hashes) and self.frame_hashes[-1] == content_hash
+            self.frame_hashes.append(content_hash)
+            if not is_held:
+                # a hold waits for the rasterizer pool task of the frame it repeats
+                self.last_task = None
+            if not self.is_sequence:
+                if is_held:
+                    self.held_frames += 1
+                elif self.frame_store is not None and (pixels := self.frame_store.get(raw_key)) is not None:
+                    self.last_pixels = pixels
+                    self.reused_frames += 1
+                elif self.frame_store is not None:
+                    self.last_pixels = self.frame_store.put(raw_key)
+                    image = self.paint_frame(frame, self.last_pixels)
+                elif os.path.exists(raw_frame):
+                    self.last_pixels = numpy.load(raw_frame, mmap_mode='r' if self.is_tiled or self.segmented else None)
+                    os.utime(raw_frame)
+                    self.reused_frames += 1
+                elif self.is_tiled:
+                    self.last_pixels, image = self.paint_mapped(frame, raw_frame)
+                else:
+                    self.last_pixels = numpy.empty((project_height, project_width, 3), numpy.uint8)
+                    image = self.paint_frame(frame, self.last_pixels, raw_frame)
+                if self.segmented:
+                    # frames wait for encode_segments as store slots or raw frame files, holds repeat the same source
+                    self.frame_sources.append(raw_frame if self.frame_store is None
+                                              else self.frame_store.slots[raw_key])
+                else:
+                    self.write_video(self.last_pixels)
+            else:
+                os.makedirs(self.object_name, exist_ok=True)
+                frame_file = os.path.join(self.object_name, f"{index}.{self.codec}")
+                if index < len(self.previous_hashes) and self.previous_hashes[index] == content_hash \
+                        and os.path.exists(frame_file):
+                    self.reused_frames += 1
+                elif is_held:
+                    self.encode(index, frame_file, source_index=index - 1)
+                    self.held_frames += 1
+                elif self.is_tiled or self.rasterizer != qt_rasterizer:
+                    if os.path.exists(raw_frame):
+                        pixels = numpy.load(raw_frame, mmap_mode='r')
+                        os.utime(raw_frame)
+                    elif self.is_tiled:
+                        pixels, image = self.paint_mapped(frame, raw_frame)
+                    else:
+                        pixels = numpy.empty((project_height, project_width, 3), numpy.uint8)
+                        image = self.paint_frame(frame, pixels)
+                    self.encode(index, frame_file, pixels, painting=self.last_task)
+                else:
+                    image = self.paintmate.canvas.render_frame(frame)
+                    self.encode(index, frame_file, image)
+        if image is None and not self.is_sequence and self.last_task is not None and self.last_task.done():
+            image = preview_image(self.last_pixels)
         self.produce_3(image)
 
-    def produce_3(self, image):
-        self.frames += 1
-        self.current_frame.setText(str(self.frames))
-        self.delta_time.setText(str((datetime.datetime.now() - self.start_frame_time_value).seconds))
-        self.total_time.setText(str((datetime.datetime.now() - self.start_time_value).seconds))
-        self.placeholder.setPixmap(QPixmap.fromImage(image))
-        if self.frames != self.paintmate.database.settings[count_of_frames]:
-            self.produce_1()
-            return
+    def paint_frame(self, frame, pixels, raw_frame=None):
+        """
+        Paints a frame in place or, for NumPy renders, hands it to the rasterizer pool. Every pool task borrows a
+        connection of its own and the render thread waits while rasterizer_queue frames are queued
+        :param frame:
+        :param pixels: array to paint into
+        :param raw_frame: optional .npy file of the project cache the frame is saved to once painted
+        :return: QImage for the preview or None for a frame on the pool, then self.last_task finishes it
+        """
+
+        import numpy
+
+        if self.rasterizer_pool is None:
+            image = self.paint(frame, pixels)
+            if raw_frame is not None:
+                numpy.save(raw_frame, pixels)
+            return image
+        self.rasterizer_slots.acquire()
+        self.last_task = self.rasterizer_pool.submit(self.rasterize, frame, pixels, raw_frame)
+        self.last_task.add_done_callback(lambda _: self.rasterizer_slots.release())
+        self.rasterized.append(self.last_task)
+        return None
+
+    def rasterize(self, frame, pixels, raw_frame):
+        """
+        Rasterizer pool task, the NumPy fills and sqlite release the GIL for most of the time
+        :param frame:
+        :param pixels:
+        :param raw_frame: .npy file or None
+        :return:
+        """
+
+        import numpy
+
+        database = self.worker_databases.get()
+        try:
+            rasterize_frame(database, frame, pixels)
+        finally:
+            self.worker_databases.put(database)
+        if raw_frame is not None:
+            numpy.save(raw_frame, pixels)
+
+    def close_rasterizer(self):
+        """
+        Waits for the frames on the rasterizer pool and closes the connections of its tasks. A failed video frame is
+        raised here, a failed sequence frame is counted by its encoder task
+        :return:
+        """
+
+        self.rasterizer_pool.shutdown()
+        while not self.worker_databases.empty():
+            self.worker_databases.get().database.close()
         if not self.is_sequence:
-            cv2.destroyAllWindows()
-            self.video.release()
-        self.render_status.setText(f"завершено, время начала: {self.start_time_value.strftime('%H:%M:%S')}, "
-                                   f"время конца: {datetime.datetime.now().strftime('%H:%M:%S')}")
+            for task in self.rasterized:
+                task.result()
 
-    def closeEvent(self, event):
-        self.paintmate.show()
+    def write_video(self, pixels):
+        """
+        Writes video frames in order, a frame still on the rasterizer pool holds back the frames after it
+        :param pixels: frame to write after the ones queued before it
+        :return:
+        """
 
-    def wheelEvent(self, event):
-        if not (event.modifiers() & Qt.ControlModifier):
-            return
-        aspect_ratio = self.placeholder.minimumWidth() / self.placeholder.minimumHeight()
-        if event.angleDelta().y() > 0:
-            new_width = self.placeholder.minimumWidth() + self.paintmate.database.settings[scale_step]
-            self.placeholder.setMinimumWidth(new_width)
-            self.placeholder.setMinimumHeight(int(new_width / aspect_ratio))
-        else:
-            if self.placeholder.minimumWidth() < canvas_size_limit or \
-                    self.placeholder.minimumHeight() < canvas_size_limit:
-                return
-            new_width = self.placeholder.minimumWidth() - self.paintmate.database.settings[scale_step]
-            self.placeholder.setMinimumWidth(new_width)
-            self.placeholder.setMinimumHeight(int(new_width / aspect_ratio))
+        self.queued_frames.append((self.last_task, pixels))
+        while self.queued_frames and (self.queued_frames[0][0] is None or self.queued_frames[0][0].done()
+                                      or len(self.queued_frames) > rasterizer_queue):
+            task, pixels = self.queued_frames.popleft()
+            if task is not None:
+                task.result()
+            self.video.write(pixels)
+
+    def encode(self, index, frame_file, frame=None, source_index=None, painting=None):
+        """
+        Hands a sequence frame to the encoder pool, the render thread waits while sequence_encoder_queue frames are
+        queued, so rendering can't run away from the disk
+        :param index: number of the frame in the sequence
+        :param frame_file:
+        :param frame: QImage or BGR array to write
+        :param source_index: a held frame is a copy of this frame file, made once the file is written
+        :param painting: rasterizer pool task that paints frame, it is waited for
+        :return:
+        """
+
+        self.encoder_slots.acquire()
+        source = None if source_index is None \
+            else (os.path.join(self.object_name, f"{source_index}.{self.codec}"), self.encoded.get(source_index))
+        self.encoded[index] = self.encoder.submit(self.write_frame, frame_file, frame, source, painting)
+        self.encoded[index].add_done_callback(lambda _: self.encoder_slots.release())
+
+    def write_frame(self, frame_file, frame, source, painting=None):
+        """
+        Encoder pool task, QImage.save and cv2.imwrite release the GIL while they compress
+        :param frame_file:
+        :param frame: QImage or BGR array
+        :param source: path and pending task of the frame file to copy or None
+        :param painting: rasterizer pool task that paints frame or None
+        :return:
+        """
+
+        if painting is not None:
+            painting.result()
+        if source is not None:
+            source_file, source_task = source
+            if source_task is not None:
+                source_task.result()
+            shutil.copyfile(source_file, frame_file)
+        elif isinstance(frame, QImage):
+            if not frame.save(frame_file, None, self.qt_quality):
+                raise OSError(f"{frame_file} isn't written")
+        else:
+            import cv2
+
+            if not cv2.imwrite(frame_file, frame, self.cv_parameters):
+                raise OSError(f"{frame_file} isn't written")
+
+    def paint(self, frame, pixels):
+        """
+        Rasterizes a frame into a BGR array with the chosen rasterizer
+        :param frame:
+        :param pixels: array of shape (height, width, 3), e.g. a slot of the frame store or a memory-mapped raw frame
+        :return: QImage for the preview
+        """
+
+        if self.rasterizer == numpy_rasterizer:
+            return preview_image(rasterize_frame(self.paintmate.database, frame, pixels))
+        if self.is_tiled:
+            self.paintmate.canvas.render_tiles(frame, pixels)
+            return self.paintmate.canvas.frame_raster(OrderedDict(), 1, frame, scrub_preview_max_side)
+        image = self.paintmate.canvas.render_frame(frame)
+        pixels[:] = image_to_bgr(image)
+        return image
+
+    def paint_mapped(self, frame, raw_frame):
+        """
+        Paints a frame into a new memory-mapped .npy file of the project cache
+        :param frame:
+        :param raw_frame: path of the file
+        :return: read-only memory map of the frame pixels and QImage for the preview
+        """
+
+        import numpy
+
+        pixels = numpy.lib.format.open_memmap(raw_frame, 'w+', numpy.uint8,
+                                              (self.paintmate.database.settings[height],
+                                               self.paintmate.database.settings[width], 3))
+        image = self.paint(frame, pixels)
+        pixels.flush()
+        del pixels
+        return numpy.load(raw_frame, mmap_mode='r'), image
+
+    def source_pixels(self, source):
+        """
+        :param source: slot of the frame store or path of a raw frame
+        :return: BGR array, a raw frame is mapped only while the caller holds it, so files aren't kept open
+        """
+
+        import numpy
+
+        return self.frame_store.frames[source] if isinstance(source, int) else numpy.load(source, mmap_mode='r')
+
+    def encode_segments(self):
+        """
+        Cuts the frames into video_segments parts and JPEG-encodes every part into its own file on a thread pool,
+        cv2.imencode releases the GIL, so the encoding scales with cores. A held frame reuses the bytes of the frame
+        before it. The parts are stitched into an MJPG avi without encoding them again
+        :return:
+        """
+
+        import cv2
+
+        count = len(self.frame_sources)
+        length = max(1, -(-count // video_segments))
+        segments = [(f"{self.object_name}.segment{number}", start, min(count, start + length))
+                    for number, start in enumerate(range(0, count, length))]
+
+        def encode(segment):
+            path, start, end = segment
+            sizes = list()
+            with open(path, 'wb') as segment_file:
+                for index in range(start, end):
+                    if index == start or self.frame_sources[index] != self.frame_sources[index - 1]:
+                        encoded = cv2.imencode(".jpg", self.source_pixels(self.frame_sources[index]),
+                                               [cv2.IMWRITE_JPEG_QUALITY, mjpg_quality])[1].tobytes()
+                    segment_file.write(encoded)
+                    sizes.append(len(encoded))
+            return sizes
+
+        with ThreadPoolExecutor(video_segments) as encoder:
+            segment_sizes = list(encoder.map(encode, segments))
+        if sum(map(sum, segment_sizes)) + 24 * count < avi_size_limit:
+            with MjpegAviWriter(self.object_name, self.paintmate.database.settings[width],
+                                self.paintmate.database.settings[height],
+                                self.paintmate.database.settings[fps]) as video:
+                for (path, _, __), sizes in zip(segments, segment_sizes):
+                    with open(path, 'rb') as segment_file:
+                        for size in sizes:
+                            video.write(segment_file.read(size))
+        else:
+            video = self.video_writer()
+            for source in self.frame_sources:
+                video.write(self.source_pixels(source))
+            video.release()
+        for path, _, __ in segments:
+            os.remove(path)
+        self.frame_sources = list()
+
+    def produce_3(self, image):
+        self.frames += 1
+        self.current_frame.setText(str(self.frames))
+        self.delta_time.setText(str((datetime.datetime.now() - self.start_frame_time_value).seconds))
+        self.total_time.setText(str((datetime.datetime.now() - self.start_time_value).seconds))
+        if image is not None:
+            self.placeholder.setPixmap(QPixmap.fromImage(image))
+        if self.frames != self.paintmate.database.settings[count_of_frames]:
+            self.produce_1()
+            return
+        if self.rasterizer_pool is not None:
+            self.close_rasterizer()
+        if not self.is_sequence:
+            if self.segmented:
+                self.encode_segments()
+            else:
+                for _, pixels in self.queued_frames:
+                    self.video.write(pixels)
+                self.video.release()
+            if self.frame_store is not None:
+                self.frame_store.close()
+        else:
+            self.encoder.shutdown()
+            failed = [index for index, task in self.encoded.items() if task.exception() is not None]
+            for index in failed:
+                # the next render writes the frame again
+                self.frame_hashes[index] = None
+            self.failed_frames = len(failed)
+            for stale_frame in range(len(self.frame_hashes), len(self.previous_hashes)):
+                if os.path.exists(frame_file := os.path.join(self.object_name, f"{stale_frame}.{self.codec}")):
+                    os.remove(frame_file)
+            self.save_manifest()
+        self.last_pixels = None
+        self.prune_raw_frames()
+        self.render_status.setText(f"завершено, время начала: {self.start_time_value.strftime('%H:%M:%S')}, "
+                                   f"время конца: {datetime.datetime.now().strftime('%H:%M:%S')}, "
+                                   f"кадров без изменений: {self.reused_frames}, "
+                                   f"повторов предыдущего кадра: {self.held_frames}"
+                                   + (f", ошибок записи: {self.failed_frames}" if self.failed_frames else ''))
+
+    def prune_raw_frames(self):
+        """
+        Keeps the raw frames of the project cache within raw_frame_cache_limit bytes. Frames whose content is no
+        longer in the animation are removed first, then the least recently used ones
+        :return:
+        """
+
+        directory = self.paintmate.database.cache_directory("frames")
+        current = set(self.frame_hashes)
+        raw_frames = list()
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            try:
+                if name.split('_')[0] not in current:
+                    os.remove(path)
+                else:
+                    raw_frames.append((os.path.getmtime(path), os.path.getsize(path), path))
+            except OSError:
+                # a frame still mapped on Windows is removed by a later render
+                continue
+        total = sum(size for _, size, __ in raw_frames)
+        for _, size, path in sorted(raw_frames):
+            if total <= raw_frame_cache_limit:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                continue
+
+    def closeEvent(self, event):
+        self.paintmate.show()
+
+    def wheelEvent(self, event):
+        if not (event.modifiers() & Qt.ControlModifier):
+            return
+        aspect_ratio = self.placeholder.minimumWidth() / self.placeholder.minimumHeight()
+        if event.angleDelta().y() > 0:
+            new_width = self.placeholder.minimumWidth() + self.paintmate.database.settings[scale_step]
+            self.placeholder.setMinimumWidth(new_width)
+            self.placeholder.setMinimumHeight(int(new_width / aspect_ratio))
+        else:
+            if self.placeholder.minimumWidth() < canvas_size_limit or \
+                    self.placeholder.minimumHeight() < canvas_size_limit:
+                return
+            new_width = self.placeholder.minimumWidth() - self.paintmate.database.settings[scale_step]
+            self.placeholder.setMinimumWidth(new_width)
+            self.placeholder.setMinimumHeight(int(new_width / aspect_ratio))
 
 
 class ChangeObjectWindow(QWidget, DeviceInfo, ChangeObjectWindowUi.Ui_Form):
@@ -677,13 +1837,467 @@ class ChangeObjectWindow(QWidget, DeviceInfo, ChangeObjectWindowUi.Ui_Form):
                                        color_window.currentColor().blue(), color_window.currentColor().alpha())
 
 
+class Timeline(QAbstractSlider):
+    """
+    Custom-painted timeline ruler with a playhead. It has no child widgets and paints only the ticks visible
+    from its scroll offset, so the cost doesn't depend on the count of frames
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setOrientation(Qt.Horizontal)
+        self.setMinimum(1)
+        self.setFixedHeight(timeline_height)
+        self.step = timeline_constant_step
+        self.starts = [0]
+        self.label_font = QFont()
+        self.label_font.setPointSize(10)
+        self.scroll_bar = QScrollBar(Qt.Horizontal, parent)
+        self.scroll_bar.valueChanged.connect(self.update)
+        self.rangeChanged.connect(self.update_scroll_range)
+        self.valueChanged.connect(self.follow_value)
+
+    def set_step(self, step):
+        """
+        :param step: pixels between neighbouring frames
+        :return:
+        """
+
+        self.step = max(1, step)
+        self.update_scroll_range()
+        self.follow_value()
+
+    def set_exposures(self, exposures):
+        """
+        :param exposures: output frames every frame is held for, a frame takes that many steps of the ruler
+        :return:
+        """
+
+        self.starts = [0] + list(itertools.accumulate(exposures))
+        self.update_scroll_range()
+        self.follow_value()
+
+    def update_scroll_range(self):
+        self.scroll_bar.setRange(0, max(0, self.start_of(self.maximum()) * self.step + 2 * timeline_label_width -
+                                        self.width()))
+        self.scroll_bar.setPageStep(self.width())
+        self.update()
+
+    def start_of(self, frame):
+        """
+        :param frame:
+        :return: count of output frames before the frame
+        """
+
+        if frame <= len(self.starts):
+            return self.starts[frame - 1]
+        return self.starts[-1] + frame - len(self.starts)
+
+    def x_of(self, frame):
+        return self.start_of(frame) * self.step - self.scroll_bar.value() + timeline_label_width // 4
+
+    def frame_at(self, x):
+        position = int((x + self.scroll_bar.value() - timeline_label_width // 4) / self.step + 0.5)
+        if position >= self.starts[-1]:
+            frame = len(self.starts) + position - self.starts[-1]
+        else:
+            frame = bisect.bisect_right(self.starts, position)
+        return min(self.maximum(), max(1, frame))
+
+    def follow_value(self):
+        """
+        Scrolls the ruler so the playhead stays visible
+        :return:
+        """
+
+        x = self.x_of(self.value())
+        if x < 0 or x > self.width() - timeline_label_width // 4:
+            self.scroll_bar.setValue(self.scroll_bar.value() + x - self.width() // 2)
+        self.update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), QColor(59, 59, 75))
+        painter.setFont(self.label_font)
+        label_every = 1
+        while label_every * self.step < timeline_label_width:
+            label_every *= 2
+        tick_every = 1 if self.step >= 4 else label_every
+        first = max(1, self.frame_at(0) - label_every)
+        first -= (first - 1) % tick_every
+        painter.setPen(QPen(QColor(255, 255, 255), 1))
+        for frame in range(first, self.frame_at(self.width()) + 1, tick_every):
+            x = self.x_of(frame)
+            if tick_every == 1 and self.start_of(frame + 1) - self.start_of(frame) > 1:
+                painter.fillRect(x, self.height() - 4, self.x_of(frame + 1) - x, 2, QColor(124, 124, 255))
+            if (frame - 1) % label_every:
+                painter.drawLine(x, self.height() - 6, x, self.height())
+            else:
+                painter.drawLine(x, self.height() - 12, x, self.height())
+                painter.drawText(x + 2, 0, timeline_label_width, self.height() - 14, Qt.AlignLeft | Qt.AlignBottom,
+                                 str(frame))
+        x = self.x_of(self.value())
+        painter.fillRect(x - 1, 0, 3, self.height(), QColor(124, 124, 255))
+        painter.end()
+
+    def mousePressEvent(self, event):
+        self.setSliderDown(True)
+        self.setValue(self.frame_at(event.x()))
+
+    def mouseMoveEvent(self, event):
+        if self.isSliderDown():
+            self.setValue(self.frame_at(event.x()))
+
+    def mouseReleaseEvent(self, event):
+        self.setSliderDown(False)
+
+    def wheelEvent(self, event):
+        self.scroll_bar.setValue(self.scroll_bar.value() - event.angleDelta().y())
+
+    def resizeEvent(self, event):
+        self.update_scroll_range()
+
+
+class ThumbnailStrip(QWidget):
+    """
+    Filmstrip of frame thumbnails under the timeline. Thumbnails are rendered by a daemon thread through its own
+    connection to the project and are stored on disk by the content hash of each frame, so only frames whose
+    objects changed are rendered again. Both the images in memory and the files on disk are kept in LRU order
+    """
+
+    thumbnail_ready = pyqtSignal(int, int, int, QImage)
+
+    def __init__(self, timeline, database, parent=None):
+        super().__init__(parent)
+        self.timeline = timeline
+        self.database = database
+        self.setFixedHeight(thumbnail_height)
+        self.images = OrderedDict()
+        self.stale = set()
+        self.generations = dict()
+        self.epoch = 0
+        self.pending = set()
+        self.wanted = set()
+        self.requests = queue.Queue()
+        self.request_timer = QTimer(self)
+        self.request_timer.setSingleShot(True)
+        self.request_timer.timeout.connect(self.send_requests)
+        self.thumbnail_ready.connect(self.receive)
+        self.timeline.scroll_bar.valueChanged.connect(self.update)
+        self.timeline.rangeChanged.connect(self.update)
+        self.worker_database = Database()
+        self.worker_database.connect(database.database_file)
+        self.worker_database.load_settings()
+        self.cache = database.cache_directory("thumbnails")
+        self.files = dict()
+        threading.Thread(target=self.work, daemon=True).start()
+
+    def invalidate(self, frame=None):
+        """
+        Marks a thumbnail as outdated, the previous image is shown until the new one is ready
+        :param frame: edited frame or None when frames were shifted
+        :return:
+        """
+
+        if frame is None:
+            self.epoch += 1
+            self.stale = set(self.images)
+        else:
+            self.generations[frame] = self.generations.get(frame, 0) + 1
+            self.stale.add(frame)
+        self.update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), QColor(51, 51, 69))
+        thumbnail_width = int(self.height() * self.database.settings[width] / self.database.settings[height])
+        show_every = 1
+        while show_every * self.timeline.step < thumbnail_width:
+            show_every *= 2
+        first = max(1, self.timeline.frame_at(0) - show_every)
+        first -= (first - 1) % show_every
+        for frame in range(first, self.timeline.frame_at(self.width()) + 1, show_every):
+            if frame in self.images:
+                self.images.move_to_end(frame)
+                painter.drawImage(self.timeline.x_of(frame), 0, self.images[frame])
+            if frame not in self.images or frame in self.stale:
+                self.wanted.add(frame)
+        painter.end()
+        if self.wanted and not self.request_timer.isActive():
+            self.request_timer.start(thumbnail_request_delay_ms)
+
+    def send_requests(self):
+        for frame in self.wanted - self.pending:
+            self.pending.add(frame)
+            self.requests.put((frame, self.epoch, self.generations.get(frame, 0)))
+        self.wanted.clear()
+
+    def receive(self, frame, epoch, generation, image):
+        self.pending.discard(frame)
+        if image.isNull():
+            # the thread failed to make it, the frame is requested again on a later repaint
+            return
+        if epoch == self.epoch and generation == self.generations.get(frame, 0):
+            self.stale.discard(frame)
+        elif frame in self.images:
+            return
+        self.images[frame] = image
+        self.images.move_to_end(frame)
+        while len(self.images) > thumbnail_cache_size:
+            self.stale.discard(self.images.popitem(last=False)[0])
+        self.update()
+
+    def work(self):
+        """
+        Thumbnail thread loop, it never touches widgets and talks to the GUI thread through thumbnail_ready.
+        A failed request is answered with a null image, so one broken frame doesn't stop the strip
+        :return:
+        """
+
+        self.prune_files()
+        while (request := self.requests.get()) is not None:
+            frame, epoch, generation = request
+            try:
+                image = self.thumbnail(frame)
+            except Exception:
+                image = QImage()
+            self.thumbnail_ready.emit(frame, epoch, generation, image)
+
+    def thumbnail(self, frame):
+        """
+        Loads the thumbnail of a frame from disk or renders and saves it. The file of the frame's previous content
+        is removed once no other frame shows it
+        :param frame:
+        :return: QImage
+        """
+
+        self.worker_database.load_settings()
+        project_width, project_height = self.worker_database.settings[width], self.worker_database.settings[height]
+        path = os.path.join(self.cache, f"{self.worker_database.frame_hash(frame)}_{project_width}x{project_height}"
+                                        f".png")
+        previous = self.files.get(frame)
+        self.files[frame] = path
+        if previous not in (None, path) and previous not in self.files.values():
+            try:
+                os.remove(previous)
+            except OSError:
+                pass
+        image = QImage(path)
+        if not image.isNull():
+            os.utime(path)
+            return image
+        image = QImage(max(1, int(thumbnail_height * project_width / project_height)), thumbnail_height,
+                       QImage.Format_RGB32)
+        image.fill(QColor(255, 255, 255))
+        painter = QPainter(image)
+        painter.setRenderHint(QPainter.Antialiasing)
+        painter.setTransform(QTransform.fromScale(image.width() / project_width, image.height() / project_height))
+        paint_objects(painter, self.worker_database, self.worker_database.objects(frame=frame))
+        painter.end()
+        image.save(path)
+        return image
+
+    def prune_files(self):
+        """
+        Keeps at most thumbnail_files_limit files in the thumbnails cache, the least recently used are removed
+        :return:
+        """
+
+        files = list()
+        for name in os.listdir(self.cache):
+            path = os.path.join(self.cache, name)
+            try:
+                files.append((os.path.getmtime(path), path))
+            except OSError:
+                continue
+        for _, path in sorted(files)[:max(0, len(files) - thumbnail_files_limit)]:
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+
+    def close_worker(self):
+        self.requests.put(None)
+
+
+class ObjectsModel(QAbstractListModel):
+    """
+    Model of the objects area, it is filled from a snapshot of the current frame once per frame change.
+    Rows are keyed by (object_type, identifier) so the selection doesn't depend on the displayed text
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.rows = list()
+
+    def reload(self, objects):
+        self.beginResetModel()
+        self.rows = [(elem[11], elem[0], elem[10]) for elem in objects]
+        self.endResetModel()
+
+    def row_of(self, key):
+        for row, (object_type, identifier, _) in enumerate(self.rows):
+            if (object_type, identifier) == key:
+                return row
+        return None
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        object_type, identifier, name = self.rows[index.row()]
+        if role == Qt.DisplayRole:
+            return f"{name}_{object_type}_{identifier}"
+        if role == Qt.UserRole:
+            return object_type, identifier
+        return None
+
+
+class RecentProjects(QAbstractListModel):
+    """
+    Recently opened projects listed from a small index file in the user's home directory, so the project picker
+    doesn't open any project to show them. Entries whose project file was modified after they were written are
+    refreshed by a daemon thread through its own connection
+    """
+
+    entry_ready = pyqtSignal(dict)
+
+    def __init__(self):
+        super().__init__()
+        self.index_file = os.path.join(recent_projects_directory, "recent.json")
+        self.entries = self.load()
+        self.pixmaps = dict()
+        self.entry_ready.connect(self.receive)
+
+    def load(self):
+        try:
+            with open(self.index_file, 'r') as index_file:
+                return json.load(index_file)[:recent_projects_limit]
+        except (OSError, ValueError):
+            return list()
+
+    def save(self):
+        os.makedirs(recent_projects_directory, exist_ok=True)
+        with open(self.index_file, 'w') as index_file:
+            json.dump(self.entries, index_file)
+
+    def remember(self, database_file):
+        """
+        Moves an opened project to the top of the list, its metadata is read later by "refresh"
+        :param database_file:
+        :return:
+        """
+
+        path = os.path.abspath(database_file)
+        entry = next((elem for elem in self.entries if elem["path"] == path), {"path": path, "mtime": None})
+        self.beginResetModel()
+        self.entries = [entry] + [elem for elem in self.entries if elem["path"] != path][:recent_projects_limit - 1]
+        self.endResetModel()
+        self.save()
+
+    def refresh(self):
+        """
+        Starts a daemon thread that re-reads the entries whose project file has changed or disappeared
+        :return:
+        """
+
+        stale = [dict(elem) for elem in self.entries if not os.path.exists(elem["path"]) or
+                 os.path.getmtime(elem["path"]) != elem["mtime"] or not os.path.exists(elem.get("thumbnail", ''))]
+        if stale:
+            # Database is a DeviceInfo that creates a QDesktopWidget, so it is made here, on the GUI thread
+            threading.Thread(target=self.work, args=([(entry, Database()) for entry in stale],), daemon=True).start()
+
+    def work(self, stale):
+        """
+        Refresh thread, it never touches the model and talks to the GUI thread through entry_ready
+        :param stale: copies of the outdated entries, each with an unconnected Database made on the GUI thread
+        :return:
+        """
+
+        for entry, database in stale:
+            if not os.path.exists(entry["path"]):
+                entry["missing"] = True
+                self.entry_ready.emit(entry)
+                continue
+            entry["mtime"] = os.path.getmtime(entry["path"])
+            try:
+                database.connect(entry["path"])
+                database.load_settings()
+                entry["frames"] = database.settings[count_of_frames]
+                entry["width"], entry["height"] = database.settings[width], database.settings[height]
+                image = QImage(max(1, int(recent_thumbnail_height * entry["width"] / entry["height"])),
+                               recent_thumbnail_height, QImage.Format_RGB32)
+                image.fill(QColor(255, 255, 255))
+                painter = QPainter(image)
+                painter.setRenderHint(QPainter.Antialiasing)
+                painter.setTransform(QTransform.fromScale(image.width() / entry["width"],
+                                                          image.height() / entry["height"]))
+                paint_objects(painter, database, database.objects(frame=1))
+                painter.end()
+            except sqlite3.Error:
+                continue
+            finally:
+                if database.database is not None:
+                    database.database.close()
+            os.makedirs(os.path.join(recent_projects_directory, "thumbnails"), exist_ok=True)
+            entry["thumbnail"] = os.path.join(recent_projects_directory, "thumbnails",
+                                              f"{hashlib.sha1(entry['path'].encode()).hexdigest()}.png")
+            image.save(entry["thumbnail"])
+            self.entry_ready.emit(entry)
+
+    def receive(self, entry):
+        for row, elem in enumerate(self.entries):
+            if elem["path"] != entry["path"]:
+                continue
+            if entry.pop("missing", False):
+                self.beginRemoveRows(QModelIndex(), row, row)
+                del self.entries[row]
+                self.endRemoveRows()
+            else:
+                self.entries[row] = entry
+                self.pixmaps.pop(entry["path"], None)
+                self.dataChanged.emit(self.index(row), self.index(row))
+            self.save()
+            return
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.entries)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        entry = self.entries[index.row()]
+        if role == Qt.DisplayRole:
+            if entry.get("frames") is None:
+                return os.path.basename(entry["path"])
+            return (f"{os.path.basename(entry['path'])}\n"
+                    f"{entry['frames']} кадров, {entry['width']}x{entry['height']}, "
+                    f"{datetime.datetime.fromtimestamp(entry['mtime']).strftime('%d.%m.%Y %H:%M')}")
+        if role == Qt.DecorationRole and entry.get("thumbnail"):
+            if entry["path"] not in self.pixmaps:
+                self.pixmaps[entry["path"]] = QPixmap(entry["thumbnail"])
+            return self.pixmaps[entry["path"]]
+        if role in (Qt.ToolTipRole, Qt.UserRole):
+            return entry["path"]
+        return None
+
+
 class ChooseProjectWindow(QWidget, DeviceInfo, ChooseProjectWindowUi.Ui_Form):
-    def __init__(self, open_project, create_project):
+    def __init__(self, open_project, create_project, recent_projects):
         super().__init__()
         self.setupUi(self)
         self.position_to_center()
         self.create_button.clicked.connect(create_project)
         self.open_button.clicked.connect(open_project)
+        self.recent_list = QListView(self)
+        self.recent_list.setModel(recent_projects)
+        self.recent_list.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.recent_list.setStyleSheet("color: white; border-style: none")
+        self.recent_list.activated.connect(lambda index: open_project(index.data(Qt.UserRole)))
+        self.gridLayout.addWidget(self.recent_list, 3, 1, 1, 1)
+        recent_projects.refresh()
 
 
 class Canvas(QWidget, DeviceInfo):
@@ -701,132 +2315,223 @@ class Canvas(QWidget, DeviceInfo):
         self.setMinimumWidth(self.paintmate.database.settings[width])
         self.setMinimumHeight(self.paintmate.database.settings[height])
         self.delta_bounds = ([0, 0], [0, 0])
-        self.alpha_divisor = 10
+        self.onion_cache = OrderedDict()
+        self.scrub_cache = OrderedDict()
+        self.scrub_frame = None
+        self.pyramid = list()
+        self.zooming = False
+        self.zoom_timer = QTimer(self)
+        self.zoom_timer.setSingleShot(True)
+        self.zoom_timer.timeout.connect(self.settle_zoom)
+        self.monitor = PerformanceMonitor()
 
     def paintEvent(self, event):
+        start_time, statements = time.perf_counter(), self.paintmate.database.statement_count
+        objects_count = points_count = 0
         painter = QPainter(self)
-        painter.begin(self)
+        if self.scrub_frame is not None:
+            painter.setRenderHint(QPainter.SmoothPixmapTransform)
+            painter.drawImage(QRectF(0, 0, self.minimumWidth(), self.minimumHeight()),
+                              self.frame_raster(self.scrub_cache, scrub_cache_size, self.scrub_frame,
+                                                scrub_preview_max_side))
+        elif self.zooming and self.pyramid:
+            self.paint_from_pyramid(painter, event.rect())
+        else:
+            objects_count, points_count = self.paint_frame(painter, self.minimumWidth(), self.minimumHeight(),
+                                                           event.rect())
+        if self.monitor.enabled:
+            self.monitor.record_paint(self.paintmate.database.settings[current_frame], time.perf_counter() - start_time,
+                                      objects_count, points_count,
+                                      self.paintmate.database.statement_count - statements)
+            painter.resetTransform()
+            self.monitor.paint(painter, self.visibleRegion().boundingRect().topLeft())
+        painter.end()
+        if self.monitor.enabled:
+            self.monitor.input_shown()
+
+    def paint_frame(self, painter, target_width, target_height, exposed=None, frame=None):
+        """
+        Paints a frame in project coordinates under a single scaling transform
+        :param painter:
+        :param target_width: width of the paint device in pixels
+        :param target_height: height of the paint device in pixels
+        :param exposed: optional QRect in device pixels, objects outside of it are skipped
+        :param frame: frame number to paint without the onion skin, the current frame with it by default
+        :return: counts of drawn objects and points
+        """
+
+        painter.setTransform(QTransform.fromScale(target_width / self.paintmate.database.settings[width],
+                                                  target_height / self.paintmate.database.settings[height]), True)
+        area = None
+        if exposed is not None:
+            area = painter.transform().inverted()[0].mapRect(QRectF(exposed)).getCoords()
         painter.setPen(QPen(QColor(0, 0, 0, 0), 0))
         painter.setBrush(QBrush(QColor(255, 255, 255)))
-        painter.drawRect(0, 0, self.minimumWidth(), self.minimumHeight())
-        if self.paintmate.database.settings[ghost]:
-            self.ghost_paint(painter)
-        for elem in self.paintmate.database.objects():
-            (identifier, frame_id, object_stroke_width, object_color, x, y, xx, yy,
-             object_z_index, object_fill_color, name) = elem
-            if object_stroke_width is not None:
-                object_stroke_width = (object_stroke_width / self.paintmate.database.settings[width] *
-                                       self.minimumWidth())
-            if all(map(lambda el: (False if el is None else True), elem[:-1])):  # ellipse
-                painter.setPen(QPen(QColor(*map(int, object_color.split('|'))), object_stroke_width))
-                painter.setBrush(QBrush(QColor(*map(int, object_fill_color.split('|')))))
-                x = int(x * self.minimumWidth() / self.paintmate.database.settings[width])
-                y = int(y * self.minimumHeight() / self.paintmate.database.settings[height])
-                xx = int(xx * self.minimumWidth() / self.paintmate.database.settings[width])
-                yy = int(yy * self.minimumHeight() / self.paintmate.database.settings[height])
-                painter.drawEllipse(x, y, xx - x, yy - y)
-                if (f"{name}_ellipse_{identifier}" not in
-                        map(lambda e: e.text(), self.paintmate.radio_group.buttons())):
-                    button = QRadioButton(f"{name}_ellipse_{identifier}", self.paintmate.objects_area_layout_widget)
-                    self.paintmate.objects_area_layout.addWidget(button)
-                    self.paintmate.radio_group.addButton(button)
-            elif all(map(lambda el: (False if el[0] is None else True) == el[1],
-                         zip(elem[:-1], (True,) * 9 + (False,)))):  # line
-                painter.setPen(QPen(QColor(*map(int, object_color.split('|'))), object_stroke_width))
-                x = int(x * self.minimumWidth() / self.paintmate.database.settings[width])
-                y = int(y * self.minimumHeight() / self.paintmate.database.settings[height])
-                xx = int(xx * self.minimumWidth() / self.paintmate.database.settings[width])
-                yy = int(yy * self.minimumHeight() / self.paintmate.database.settings[height])
-                painter.drawLine(x, y, xx, yy)
-                if f"{name}_line_{identifier}" not in map(lambda e: e.text(), self.paintmate.radio_group.buttons()):
-                    button = QRadioButton(f"{name}_line_{identifier}", self.paintmate.objects_area_layout_widget)
-                    self.paintmate.objects_area_layout.addWidget(button)
-                    self.paintmate.radio_group.addButton(button)
-            elif all(map(lambda el: (False if el[0] is None else True) == el[1],
-                         zip(elem[:-1], (True,) * 4 + (False,) * 4 + (True,) + (False,)))):  # pen
-                painter.setBrush(QBrush(QColor(*map(int, object_color.split('|')))))
-                painter.setPen(QPen(QColor(0, 0, 0, 0), 0))
-                for _, __, x, y in self.paintmate.database.object_points(identifier, pen):
-                    x = x * self.minimumWidth() / self.paintmate.database.settings[width]
-                    y = y * self.minimumHeight() / self.paintmate.database.settings[height]
-                    painter.drawEllipse(QPoint(int(x), int(y)), object_stroke_width, object_stroke_width)
-                if f"{name}_pen_{identifier}" not in map(lambda e: e.text(), self.paintmate.radio_group.buttons()):
-                    button = QRadioButton(f"{name}_pen_{identifier}", self.paintmate.objects_area_layout_widget)
-                    self.paintmate.objects_area_layout.addWidget(button)
-                    self.paintmate.radio_group.addButton(button)
-            else:  # filler
-                points = list()
-                for _, __, x, y in self.paintmate.database.object_points(identifier, filler):
-                    x = x * self.minimumWidth() / self.paintmate.database.settings[width]
-                    y = y * self.minimumHeight() / self.paintmate.database.settings[height]
-                    points.append(QPoint(int(x), int(y)))
-                painter.setPen(QPen(QColor(0, 0, 0, 0), 0))
-                painter.setBrush(QBrush(QColor(*map(int, object_color.split('|')))))
-                painter.drawPolygon(points)
-                if f"{name}_filler_{identifier}" not in map(lambda e: e.text(),
-                                                            self.paintmate.radio_group.buttons()):
-                    button = QRadioButton(f"{name}_filler_{identifier}", self.paintmate.objects_area_layout_widget)
-                    self.paintmate.objects_area_layout.addWidget(button)
-                    self.paintmate.radio_group.addButton(button)
-        painter.end()
+        painter.drawRect(0, 0, self.paintmate.database.settings[width], self.paintmate.database.settings[height])
+        if frame is None and self.paintmate.database.settings[ghost]:
+            self.onion_paint(painter)
+        return paint_objects(painter, self.paintmate.database, self.paintmate.database.objects(area=area, frame=frame))
 
-    def ghost_paint(self, painter):
+    def onion_paint(self, painter):
         """
-        paintEvent-like function that is used for displaying the previous frame under the current as a trail
+        Composites cached tinted rasters of the neighbouring frames under the current one, the farther a frame is
+        the more it is faded. The painter must already map project coordinates
         :param painter:
         :return:
         """
 
-        for elem in self.paintmate.database.objects(1):
-            (identifier, frame_id, object_stroke_width, object_color, x, y, xx, yy,
-             object_z_index, object_fill_color, name) = elem
-            if object_stroke_width is not None:
-                object_stroke_width = (object_stroke_width / self.paintmate.database.settings[width] *
-                                       self.minimumWidth())
-            if all(map(lambda el: (False if el is None else True), elem[:-1])):  # ellipse
-                painter.setPen(QPen(QColor(0, 0, 0, 255 // self.alpha_divisor), object_stroke_width))
-                x = int(x * self.minimumWidth() / self.paintmate.database.settings[width])
-                y = int(y * self.minimumHeight() / self.paintmate.database.settings[height])
-                xx = int(xx * self.minimumWidth() / self.paintmate.database.settings[width])
-                yy = int(yy * self.minimumHeight() / self.paintmate.database.settings[height])
-                painter.drawEllipse(x, y, xx - x, yy - y)
-            elif all(map(lambda el: (False if el[0] is None else True) == el[1],
-                         zip(elem[:-1], (True,) * 9 + (False,)))):  # line
-                painter.setPen(QPen(QColor(0, 0, 0, 255 // self.alpha_divisor), object_stroke_width))
-                x = int(x * self.minimumWidth() / self.paintmate.database.settings[width])
-                y = int(y * self.minimumHeight() / self.paintmate.database.settings[height])
-                xx = int(xx * self.minimumWidth() / self.paintmate.database.settings[width])
-                yy = int(yy * self.minimumHeight() / self.paintmate.database.settings[height])
-                painter.drawLine(x, y, xx, yy)
-            elif all(map(lambda el: (False if el[0] is None else True) == el[1],
-                         zip(elem[:-1], (True,) * 4 + (False,) * 4 + (True,) + (False,)))):  # pen
-                painter.setBrush(QBrush(QColor(0, 0, 0, 255 // self.alpha_divisor)))
-                for _, __, x, y in self.paintmate.database.object_points(identifier, pen):
-                    x = x * self.minimumWidth() / self.paintmate.database.settings[width]
-                    y = y * self.minimumHeight() / self.paintmate.database.settings[height]
-                    painter.drawEllipse(QPoint(int(x), int(y)), object_stroke_width, object_stroke_width)
-            else:  # filler
-                points = list()
-                for _, __, x, y in self.paintmate.database.object_points(identifier, filler):
-                    x = x * self.minimumWidth() / self.paintmate.database.settings[width]
-                    y = y * self.minimumHeight() / self.paintmate.database.settings[height]
-                    points.append(QPoint(int(x), int(y)))
-                painter.setBrush(QBrush(QColor(0, 0, 0, 255 // self.alpha_divisor)))
-                painter.drawPolygon(points)
-
-    def render_self(self):
-        image = QImage(self.minimumWidth(), self.minimumHeight(), QImage.Format_ARGB32)
-        # image.setDevicePixelRatio(2)
-        self.render(image)
-        if self.paintmate.database.settings[current_frame] < self.paintmate.database.settings[count_of_frames]:
-            self.paintmate.database.update_settings(current_frame=self.paintmate.database.settings[current_frame] + 1)
+        target = QRectF(0, 0, self.paintmate.database.settings[width], self.paintmate.database.settings[height])
+        for parameter, direction, tint in ((onion_before, -1, onion_before_tint), (onion_after, 1, onion_after_tint)):
+            frames_range = self.paintmate.database.settings[parameter]
+            for distance in range(frames_range, 0, -1):
+                frame = self.paintmate.database.settings[current_frame] + direction * distance
+                if not 1 <= frame <= self.paintmate.database.settings[count_of_frames]:
+                    continue
+                painter.setOpacity(onion_opacity * (frames_range - distance + 1) / frames_range)
+                painter.drawImage(target, self.onion_raster(frame, tint))
+        painter.setOpacity(1)
+
+    def frame_raster(self, cache, cache_size, frame, max_side, tint=None):
+        """
+        Returns a frame rasterized at most max_side pixels wide or high, the result is kept in the given LRU cache
+        until the frame is edited
+        :param cache: OrderedDict
+        :param cache_size: count of images the cache may hold
+        :param frame:
+        :param max_side:
+        :param tint: optional (r, g, b) tuple, a tinted frame is drawn on a transparent background instead of white
+        :return:
+        """
+
+        key = (frame, tint)
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key]
+        scale = min(1, max_side / max(self.paintmate.database.settings[width],
+                                      self.paintmate.database.settings[height]))
+        image = QImage(max(1, int(self.paintmate.database.settings[width] * scale)),
+                       max(1, int(self.paintmate.database.settings[height] * scale)),
+                       QImage.Format_ARGB32_Premultiplied)
+        image.fill(Qt.transparent if tint else QColor(255, 255, 255))
+        painter = QPainter(image)
+        painter.setTransform(QTransform.fromScale(scale, scale))
+        paint_objects(painter, self.paintmate.database, self.paintmate.database.objects(frame=frame),
+                      QColor(*tint) if tint else None)
+        painter.end()
+        cache[key] = image
+        while len(cache) > cache_size:
+            cache.popitem(last=False)
+        return image
+
+    def onion_raster(self, frame, tint):
+        return self.frame_raster(self.onion_cache, onion_cache_size, frame, onion_cache_max_side, tint)
+
+    def scrub(self, frame):
+        """
+        Shows a low-resolution preview of the frame, used while the timeline slider is held
+        :param frame: frame number or None to return to the exact painting
+        :return:
+        """
+
+        self.scrub_frame = frame
+        self.repaint()
+
+    def invalidate_rasters(self, frame=None):
+        """
+        Drops cached onion skin and scrub rasters of a single edited frame or, when frames were shifted, all of them
+        :param frame:
+        :return:
+        """
+
+        for cache in (self.onion_cache, self.scrub_cache):
+            if frame is None:
+                cache.clear()
+                continue
+            for key in [key for key in cache if key[0] == frame]:
+                del cache[key]
+
+    def build_pyramid(self):
+        """
+        Rasterizes the current frame once and downsamples it into a mipmap-style pyramid of standard zoom levels,
+        it is shown while the canvas is being zoomed until the exact repaint
+        :return:
+        """
+
+        base_scale = min(1, zoom_pyramid_max_side / max(self.paintmate.database.settings[width],
+                                                        self.paintmate.database.settings[height]))
+        image = QImage(int(self.paintmate.database.settings[width] * base_scale),
+                       int(self.paintmate.database.settings[height] * base_scale),
+                       QImage.Format_ARGB32_Premultiplied)
+        painter = QPainter(image)
+        self.paint_frame(painter, image.width(), image.height())
+        painter.end()
+        self.pyramid = [image]
+        for _ in range(zoom_pyramid_levels - 1):
+            image = image.scaled(max(1, image.width() // 2), max(1, image.height() // 2), Qt.IgnoreAspectRatio,
+                                 Qt.SmoothTransformation)
+            self.pyramid.append(image)
+
+    def paint_from_pyramid(self, painter, exposed):
+        level = next((image for image in reversed(self.pyramid) if image.width() >= self.minimumWidth()),
+                     self.pyramid[0])
+        scale_x, scale_y = level.width() / self.minimumWidth(), level.height() / self.minimumHeight()
+        painter.setRenderHint(QPainter.SmoothPixmapTransform)
+        painter.drawImage(QRectF(exposed), level, QRectF(exposed.x() * scale_x, exposed.y() * scale_y,
+                                                         exposed.width() * scale_x, exposed.height() * scale_y))
+
+    def invalidate_cache(self):
+        self.pyramid = list()
+
+    def settle_zoom(self):
+        self.zooming = False
+        self.update()
+
+    def render_frame(self, frame):
+        """
+        Paints a frame at the project resolution for the renderer, the onion skin is an editing aid and is left out
+        :param frame:
+        :return: QImage
+        """
+
+        image = QImage(self.paintmate.database.settings[width], self.paintmate.database.settings[height],
+                       QImage.Format_ARGB32)
+        painter = QPainter(image)
+        self.paint_frame(painter, image.width(), image.height(), frame=frame)
+        painter.end()
         return image
 
+    def render_tiles(self, frame, pixels, tile_size=render_tile_size):
+        """
+        Paints a frame at the project resolution tile by tile into a BGR array, usually a memory-mapped file, so only
+        one tile at a time exists as a QImage and objects outside of it are skipped
+        :param frame:
+        :param pixels: writable array of shape (height, width, 3)
+        :param tile_size: side of a tile in pixels
+        :return:
+        """
+
+        project_width = self.paintmate.database.settings[width]
+        project_height = self.paintmate.database.settings[height]
+        for y in range(0, project_height, tile_size):
+            for x in range(0, project_width, tile_size):
+                tile = QImage(min(tile_size, project_width - x), min(tile_size, project_height - y),
+                              QImage.Format_ARGB32)
+                painter = QPainter(tile)
+                painter.translate(-x, -y)
+                self.paint_frame(painter, project_width, project_height, QRect(0, 0, tile.width(), tile.height()),
+                                 frame)
+                painter.end()
+                pixels[y:y + tile.height(), x:x + tile.width()] = image_to_bgr(tile)
+
     def wheelEvent(self, event):
         if not (event.modifiers() & Qt.ControlModifier):
             self.paintmate.drawing_area.verticalScrollBar().setEnabled(True)
             return
         self.paintmate.drawing_area.verticalScrollBar().setEnabled(False)
+        if not self.pyramid:
+            self.build_pyramid()
+        self.zooming = True
+        self.zoom_timer.start(zoom_settle_ms)
         aspect_ratio = self.minimumWidth() / self.minimumHeight()
         if event.angleDelta().y() > 0:
             new_width = self.minimumWidth() + self.paintmate.database.settings[scale_step]
@@ -844,6 +2549,7 @@ class Canvas(QWidget, DeviceInfo):
             self.parent().setMinimumHeight(int(new_width / aspect_ratio))
 
     def hand_resize(self, new_width, new_height):
+        self.invalidate_cache()
         if new_width != self.minimumWidth():
             self.parent().setMinimumWidth(new_width)
             self.setMinimumWidth(new_width)
@@ -852,11 +2558,16 @@ class Canvas(QWidget, DeviceInfo):
             self.setMinimumHeight(new_height)
 
     def mouseMoveEvent(self, event):
+        if self.monitor.enabled and self.paintmate.current_tool != manipulator:
+            self.monitor.input_started(self.paintmate.current_tool, len(self.paintmate.database.spatial_index.bounds))
         self.delta_bounds[0][1], self.delta_bounds[1][1] = event.x(), event.y()
+        if self.paintmate.current_tool != manipulator or self.paintmate.selected_object:
+            self.invalidate_cache()
+            self.paintmate.invalidate_frames(self.paintmate.database.settings[current_frame])
         if self.paintmate.current_tool == manipulator:
-            for elem in self.paintmate.radio_group.buttons()[1:]:
-                if elem.isChecked():
-                    self.paintmate.database.reposition(elem.text(), *map(lambda e: e[1] - e[0], self.delta_bounds))
+            if self.paintmate.selected_object:
+                self.paintmate.database.reposition(*self.paintmate.selected_object,
+                                                   *map(lambda e: e[1] - e[0], self.delta_bounds))
         elif self.paintmate.current_tool == pen:
             self.paintmate.database.create_pen_point(event.x(), event.y(), self.minimumWidth(), self.minimumHeight())
         elif self.paintmate.current_tool == filler:
@@ -871,8 +2582,19 @@ class Canvas(QWidget, DeviceInfo):
         self.repaint()
 
     def mousePressEvent(self, event):
+        if self.monitor.enabled and self.paintmate.current_tool != manipulator:
+            self.monitor.input_started(self.paintmate.current_tool, len(self.paintmate.database.spatial_index.bounds))
         self.delta_bounds[0][0], self.delta_bounds[1][0] = event.x(), event.y()
-        if self.paintmate.current_tool == pen:
+        if self.paintmate.current_tool != manipulator:
+            self.invalidate_cache()
+            self.paintmate.invalidate_frames(self.paintmate.database.settings[current_frame])
+        if self.paintmate.current_tool == manipulator:
+            hit = self.paintmate.database.hit_test(
+                event.x() * self.paintmate.database.settings[width] / self.minimumWidth(),
+                event.y() * self.paintmate.database.settings[height] / self.minimumHeight())
+            if hit:
+                self.paintmate.select_object(hit)
+        elif self.paintmate.current_tool == pen:
             self.paintmate.database.create_pen_object()
             self.paintmate.database.create_pen_point(event.x(), event.y(), self.minimumWidth(), self.minimumHeight())
         elif self.paintmate.current_tool == filler:
@@ -885,36 +2607,524 @@ class Canvas(QWidget, DeviceInfo):
                                                           self.minimumWidth(), self.minimumHeight())
         self.repaint()
 
+    def mouseReleaseEvent(self, event):
+        if self.paintmate.current_tool != manipulator:
+            self.paintmate.update_objects_list()
+
+
+class MjpegAviWriter:
+    """
+    Writes already encoded JPEG frames into an AVI 1.0 file with a single MJPG video stream and an idx1 index,
+    sizes and frame counts are filled in on close
+    """
+
+    def __init__(self, path, frame_width, frame_height, frame_rate):
+        self.file = open(path, 'wb')
+        self.size = (frame_width, frame_height)
+        self.frame_rate = frame_rate
+        self.index = list()
+        self.largest_frame = 0
+        self.file.write(self.headers())
+        self.movi_start = self.file.tell() - 4
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def headers(self):
+        frame_width, frame_height = self.size
+        main_header = struct.pack("<14I", 1000000 // max(1, self.frame_rate),
+                                  self.largest_frame * max(1, self.frame_rate), 0, 0x10, len(self.index), 0, 1,
+                                  self.largest_frame, frame_width, frame_height, 0, 0, 0, 0)
+        stream_header = struct.pack("<4s4sI2H8I4h", b"vids", b"MJPG", 0, 0, 0, 0, 1, self.frame_rate, 0,
+                                    len(self.index), self.largest_frame, 0xFFFFFFFF, 0, 0, 0, frame_width,
+                                    frame_height)
+        stream_format = struct.pack("<I2i2H4s5I", 40, frame_width, frame_height, 1, 24, b"MJPG",
+                                    frame_width * frame_height * 3, 0, 0, 0, 0)
+        stream_list = b"strl" + self.chunk(b"strh", stream_header) + self.chunk(b"strf", stream_format)
+        header_list = b"hdrl" + self.chunk(b"avih", main_header) + self.chunk(b"LIST", stream_list)
+        return b"RIFF" + struct.pack("<I", 0) + b"AVI " + self.chunk(b"LIST", header_list) + b"LIST" \
+            + struct.pack("<I", 0) + b"movi"
+
+    @staticmethod
+    def chunk(fourcc, data):
+        return fourcc + struct.pack("<I", len(data)) + data + b"\0" * (len(data) % 2)
+
+    def write(self, frame):
+        """
+        :param frame: bytes of a JPEG image
+        :return:
+        """
+
+        self.index.append((self.file.tell() - self.movi_start, len(frame)))
+        self.largest_frame = max(self.largest_frame, len(frame))
+        self.file.write(self.chunk(b"00dc", frame))
+
+    def close(self):
+        movi_end = self.file.tell()
+        self.file.write(self.chunk(b"idx1", b"".join(struct.pack("<4s3I", b"00dc", 0x10, offset, size)
+                                                      for offset, size in self.index)))
+        riff_end = self.file.tell()
+        self.file.seek(0)
+        self.file.write(self.headers())
+        self.file.seek(4)
+        self.file.write(struct.pack("<I", riff_end - 8))
+        self.file.seek(self.movi_start - 4)
+        self.file.write(struct.pack("<I", movi_end - self.movi_start))
+        self.file.close()
+
+
+class FrameStore:
+    """
+    Raw BGR frames of a project in a single memory-mapped .npy file with a JSON manifest of frame content hashes.
+    A video rendered through it can be encoded again into any codec and container from zero-copy slices
+    """
+
+    def __init__(self, directory, frame_width, frame_height):
+        self.path = os.path.join(directory, frame_store_name)
+        self.manifest_path = os.path.join(directory, render_manifest_name)
+        self.size = [frame_width, frame_height]
+        self.slots = dict()
+        self.free_slots = list()
+        self.frames = None
+
+    def open(self, hashes):
+        """
+        Maps the store for the frames about to be encoded. Slots of contents that are no longer in the animation are
+        given to new frames, the file is rewritten with more slots when there are more distinct frames than slots
+        :param hashes: content hashes of the frames
+        :return:
+        """
+
+        import numpy
+
+        wanted = set(hashes)
+        try:
+            with open(self.manifest_path, 'r') as manifest_file:
+                manifest = json.load(manifest_file)
+        except (OSError, ValueError):
+            manifest = dict()
+        frames = None
+        if manifest.get("size") == self.size and os.path.exists(self.path):
+            frames = numpy.load(self.path, mmap_mode='r+')
+            self.slots = {key: slot for key, slot in manifest.get("slots", dict()).items() if key in wanted}
+        if frames is None or len(frames) < len(wanted):
+            grown = numpy.lib.format.open_memmap(f"{self.path}.new", 'w+', numpy.uint8,
+                                                 (max(1, len(wanted)), self.size[1], self.size[0], 3))
+            for slot, key in enumerate(list(self.slots)):
+                grown[slot] = frames[self.slots[key]]
+                self.slots[key] = slot
+            grown.flush()
+            del frames, grown
+            os.replace(f"{self.path}.new", self.path)
+            frames = numpy.load(self.path, mmap_mode='r+')
+        self.frames = frames
+        self.free_slots = sorted(set(range(len(frames))) - set(self.slots.values()), reverse=True)
+        self.save_manifest()
+
+    def get(self, content_hash):
+        """
+        :param content_hash:
+        :return: view of the stored frame or None
+        """
+
+        return self.frames[self.slots[content_hash]] if content_hash in self.slots else None
+
+    def put(self, content_hash):
+        """
+        Takes a free slot for a new frame, it is listed in the manifest only after close
+        :param content_hash:
+        :return: writable view to paint the frame into
+        """
+
+        self.slots[content_hash] = self.free_slots.pop()
+        return self.frames[self.slots[content_hash]]
+
+    def save_manifest(self):
+        with open(self.manifest_path, 'w') as manifest_file:
+            json.dump({"size": self.size, "slots": self.slots}, manifest_file)
+
+    def close(self):
+        self.frames.flush()
+        self.save_manifest()
+        self.frames = None
+
+
+class SqlTrace:
+    """
+    Opt-in statement counter of a Database fed by the sqlite3 trace callback. Statements are attributed to the
+    outermost Database method running in the current thread, the last calls are kept for a rolling summary
+    """
+
+    def __init__(self):
+        self.local = threading.local()
+        self.calls = deque(maxlen=sql_trace_window)
+        self.lock = threading.Lock()
+
+    def stack(self):
+        if not hasattr(self.local, "stack"):
+            self.local.stack = list()
+        return self.local.stack
+
+    def timed(self, site, method):
+        """
+        Wraps a Database method so its calls are timed, nested calls are accounted to the outer one
+        :param site: name of the method
+        :param method: bound method
+        :return:
+        """
+
+        def wrapper(*args, **kwargs):
+            stack = self.stack()
+            if stack:
+                return method(*args, **kwargs)
+            call = [site, 0, 0, 0]
+            stack.append(call)
+            start_time = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                call[3] = time.perf_counter() - start_time
+                stack.pop()
+                with self.lock:
+                    self.calls.append(tuple(call))
+
+        return wrapper
+
+    def statement(self, sql):
+        is_commit = sql.lstrip().upper().startswith("COMMIT")
+        stack = self.stack()
+        if not stack:
+            with self.lock:
+                self.calls.append(("other", 1, int(is_commit), 0))
+            return
+        stack[0][1] += 1
+        stack[0][2] += is_commit
+
+    def summary(self):
+        """
+        :return: dict of call sites with their calls, statements, commits and time over the rolling window
+        """
+
+        with self.lock:
+            calls = list(self.calls)
+        sites = dict()
+        for site, statements, commits, seconds in calls:
+            elem = sites.setdefault(site, {"calls": 0, "statements": 0, "commits": 0, "milliseconds": 0})
+            elem["calls"] += 1
+            elem["statements"] += statements
+            elem["commits"] += commits
+            elem["milliseconds"] += seconds * 1000
+        for elem in sites.values():
+            elem["statements_per_call"] = elem["statements"] / elem["calls"]
+        return sites
+
+    def dump(self, path):
+        with open(path, 'w') as trace_file:
+            json.dump({"window": sql_trace_window, "sites": self.summary()}, trace_file, indent=4)
+
+
+class PerformanceMonitor:
+    """
+    Measurements of the performance HUD: canvas paints and playback steps. Every paint is written to a ring buffer
+    that can be saved as CSV
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.records = deque(maxlen=performance_log_size)
+        self.steps = deque(maxlen=performance_fps_window)
+        self.playback_fps = 0
+        self.pending_input = None
+        self.last_latency_key = None
+        self.latencies = dict()
+        self.hud_font = QFont("monospace")
+        self.hud_font.setPointSize(9)
+
+    def record_paint(self, frame, seconds, objects_count, points_count, statements):
+        self.records.append((datetime.datetime.now().isoformat(timespec="milliseconds"), frame,
+                             round(seconds * 1000, 3), objects_count, points_count, statements,
+                             round(self.playback_fps, 1)))
+
+    def record_step(self, exposure):
+        """
+        Called by playing when a frame is shown
+        :param exposure: output frames the previous frame had to be held for
+        :return:
+        """
+
+        self.steps.append((time.perf_counter(), exposure))
+        if len(self.steps) > 1:
+            self.playback_fps = sum(elem[1] for elem in list(self.steps)[1:]) / (self.steps[-1][0] - self.steps[0][0])
+
+    def reset_playback(self):
+        self.steps.clear()
+        self.playback_fps = 0
+
+    def input_started(self, tool, objects_count):
+        """
+        Remembers when a drawing tool received input, inputs that come before the next paint are measured from
+        the oldest one
+        :param tool:
+        :param objects_count: objects in the frame, the latency is grouped by it
+        :return:
+        """
+
+        if self.pending_input is None:
+            self.pending_input = (time.perf_counter(), tool, objects_count)
+
+    def input_shown(self):
+        """
+        Called at the end of a canvas paint, it closes the pending input latency
+        :return:
+        """
+
+        if self.pending_input is None:
+            return
+        start_time, tool, objects_count = self.pending_input
+        self.pending_input = None
+        complexity = next((f"<{limit}" for limit in latency_complexity_buckets if objects_count < limit),
+                          f">={latency_complexity_buckets[-1]}")
+        self.last_latency_key = (tool, complexity)
+        self.latencies.setdefault(self.last_latency_key, deque(maxlen=latency_samples)).append(
+            (time.perf_counter() - start_time) * 1000)
+
+    @staticmethod
+    def percentiles(samples):
+        ordered = sorted(samples)
+        return {f"p{rank}": round(ordered[min(len(ordered) - 1, int(len(ordered) * rank / 100))], 3)
+                for rank in (50, 95, 99)}
+
+    def latency_report(self):
+        """
+        :return: input-to-pixel latency percentiles in milliseconds by tool and by objects in the frame
+        """
+
+        report = dict()
+        for (tool, complexity), samples in sorted(self.latencies.items()):
+            report.setdefault(tool, dict())[complexity] = {"samples": len(samples), **self.percentiles(samples)}
+        return report
+
+    def save_latency_report(self, path):
+        with open(path, 'w') as report_file:
+            json.dump({"budget_ms": latency_budget_ms, "tools": self.latency_report()}, report_file, indent=4)
+
+    def paint(self, painter, origin):
+        """
+        Draws the HUD in widget coordinates
+        :param painter:
+        :param origin: top left corner of the visible part of the canvas
+        :return:
+        """
+
+        if not self.records:
+            return
+        _, __, paint_ms, objects_count, points_count, statements, ___ = self.records[-1]
+        average_ms = sum(elem[2] for elem in self.records) / len(self.records)
+        lines = [f"отрисовка: {paint_ms:.1f} мс, в среднем {average_ms:.1f} мс",
+                 f"объектов: {objects_count}, точек: {points_count}",
+                 f"запросов к БД: {statements}",
+                 f"воспроизведение: {self.playback_fps:.1f} кадр/с"]
+        if self.last_latency_key:
+            latency = self.percentiles(self.latencies[self.last_latency_key])
+            lines.append(f"задержка {self.last_latency_key[0]} {self.last_latency_key[1]}: "
+                         f"{latency['p50']:.1f} / {latency['p95']:.1f} / {latency['p99']:.1f} мс")
+        painter.setFont(self.hud_font)
+        line_height = painter.fontMetrics().height()
+        painter.fillRect(origin.x(), origin.y(), 340, line_height * len(lines) + 8, QColor(0, 0, 0, 160))
+        painter.setPen(QColor(255, 255, 255))
+        for number, text in enumerate(lines):
+            painter.drawText(origin.x() + 6, origin.y() + 4 + line_height * number + painter.fontMetrics().ascent(),
+                             text)
+
+    def save_csv(self, path):
+        with open(path, 'w', newline='') as log_file:
+            writer = csv.writer(log_file)
+            writer.writerow(["time", "frame", "paint_ms", "objects", "points", "queries", "playback_fps"])
+            writer.writerows(self.records)
+
+
+class SpatialIndex:
+    """
+    Uniform grid over the bounding boxes of a single frame objects, used for click-to-select hit testing.
+    Keys are (object_type, identifier) pairs, bounds are in project coordinates
+    """
+
+    def __init__(self, cell_size=spatial_index_cell_size):
+        self.cell_size = cell_size
+        self.cells = dict()
+        self.bounds = dict()
+        self.order = dict()
+
+    def clear(self):
+        self.cells.clear()
+        self.bounds.clear()
+        self.order.clear()
+
+    def cells_of(self, bounds):
+        x, y, xx, yy = bounds
+        return itertools.product(range(int(x // self.cell_size), int(xx // self.cell_size) + 1),
+                                 range(int(y // self.cell_size), int(yy // self.cell_size) + 1))
+
+    def insert(self, key, bounds, order):
+        """
+        :param key:
+        :param bounds: (x, y, xx, yy) with x <= xx and y <= yy
+        :param order: painting order of the object, the greater one is drawn on top
+        :return:
+        """
+
+        self.bounds[key], self.order[key] = bounds, order
+        for cell in self.cells_of(bounds):
+            self.cells.setdefault(cell, set()).add(key)
+
+    def remove(self, key):
+        if key not in self.bounds:
+            return
+        for cell in self.cells_of(self.bounds[key]):
+            self.cells[cell].discard(key)
+            if not self.cells[cell]:
+                del self.cells[cell]
+        del self.bounds[key], self.order[key]
+
+    def move(self, key, delta_x, delta_y):
+        if key not in self.bounds:
+            return
+        x, y, xx, yy = self.bounds[key]
+        order = self.order[key]
+        self.remove(key)
+        self.insert(key, (x + delta_x, y + delta_y, xx + delta_x, yy + delta_y), order)
+
+    def query(self, x, y):
+        """
+        Returns keys whose bounding boxes contain the point, the topmost first
+        :return:
+        """
+
+        candidates = self.cells.get((int(x // self.cell_size), int(y // self.cell_size)), set())
+        return sorted((key for key in candidates
+                       if self.bounds[key][0] <= x <= self.bounds[key][2] and
+                       self.bounds[key][1] <= y <= self.bounds[key][3]),
+                      key=lambda key: -self.order[key])
+
 
 class Database(DeviceInfo):
     def __init__(self):
         super().__init__()
         self.database = None
+        self.database_file = None
         self.query = None
         self.settings = dict()
+        self.spatial_index = SpatialIndex()
+        self.trace = None
+        self.counting = False
+        self.statement_count = 0
         self.tables_description = {
             "setting": "fps INTEGER, current_frame INTEGER, count_of_frames INTEGER, width INTEGER, height INTEGER, "
                        "timeline_multiplier INTEGER, scale_step INTEGER, stroke_width INTEGER, color TEXT, "
-                       "fill_color TEXT, ghost INTEGER",
+                       "fill_color TEXT, ghost INTEGER, onion_before INTEGER, onion_after INTEGER, revision INTEGER",
             "pen_point": "pen_id INTEGER, x INTEGER, y INTEGER",
-            "pen": "frame_id INTEGER, stroke_width INTEGER, color TEXT, z_index INTEGER, name TEXT",
+            "pen": "frame_id INTEGER, stroke_width INTEGER, color TEXT, z_index INTEGER, name TEXT, "
+                   "bound_x INTEGER, bound_y INTEGER, bound_xx INTEGER, bound_yy INTEGER",
             "line": "frame_id INTEGER, stroke_width INTEGER, color TEXT, x INTEGER, y INTEGER, xx INTEGER, yy INTEGER, "
-                    "z_index INTEGER, name TEXT",
+                    "z_index INTEGER, name TEXT, bound_x INTEGER, bound_y INTEGER, bound_xx INTEGER, bound_yy INTEGER, "
+                    "track INTEGER",
             "ellipse": "frame_id INTEGER, stroke_width INTEGER, color TEXT, "
-                       "x INTEGER, y INTEGER, xx INTEGER, yy INTEGER, fill_color TEXT, z_index INTEGER, name TEXT",
+                       "x INTEGER, y INTEGER, xx INTEGER, yy INTEGER, fill_color TEXT, z_index INTEGER, name TEXT, "
+                       "bound_x INTEGER, bound_y INTEGER, bound_xx INTEGER, bound_yy INTEGER, track INTEGER",
             "filler_point": "filler_id INTEGER, x INTEGER, y INTEGER",
-            "filler": "frame_id INTEGER, color TEXT, z_index INTEGER, name TEXT"
+            "filler": "frame_id INTEGER, color TEXT, z_index INTEGER, name TEXT, "
+                      "bound_x INTEGER, bound_y INTEGER, bound_xx INTEGER, bound_yy INTEGER",
+            "frame_state": "frame INTEGER UNIQUE, revision INTEGER, content_hash TEXT, exposure INTEGER"
         }
 
     def connect(self, database_file):
+        self.database_file = database_file
         self.database = sqlite3.connect(database_file, check_same_thread=False)
         self.query = self.database.cursor()
 
+    def set_tracing(self, enabled):
+        """
+        Turns the SQL instrumentation on or off: every public method gets timed and the statements it executes are
+        counted through the connection trace callback
+        :param enabled:
+        :return:
+        """
+
+        if enabled and self.trace is None:
+            self.trace = SqlTrace()
+            for name, member in vars(Database).items():
+                if callable(member) and not name.startswith('_') and name not in ("connect", "set_tracing",
+                                                                                   "set_counting", "trace_statement"):
+                    setattr(self, name, self.trace.timed(name, getattr(self, name)))
+        elif not enabled and self.trace is not None:
+            for name in [name for name in vars(self) if callable(vars(Database).get(name))]:
+                delattr(self, name)
+            self.trace = None
+        self.database.set_trace_callback(self.trace_statement if self.trace or self.counting else None)
+
+    def set_counting(self, enabled):
+        """
+        Turns on the plain statement counter used by the performance HUD
+        :param enabled:
+        :return:
+        """
+
+        self.counting = enabled
+        self.database.set_trace_callback(self.trace_statement if self.trace or self.counting else None)
+
+    def trace_statement(self, sql):
+        self.statement_count += 1
+        if self.trace is not None:
+            self.trace.statement(sql)
+
     def populate(self):
         for table_name, description in self.tables_description.items():
             self.query.execute(f"CREATE TABLE {table_name} (id INTEGER PRIMARY KEY AUTOINCREMENT, {description})")
         self.query.execute(f"INSERT INTO setting({', '.join(self.tables_description['setting'].split()[::2])}) "
-                           f"VALUES(16, 1, 1, 1920, 1080, 100, 40, 4, '0|0|0|255', '0|0|0|0', 1)")
+                           f"VALUES(16, 1, 1, 1920, 1080, 100, 40, 4, '0|0|0|255', '0|0|0|0', 1, 1, 0, 0)")
+        self.create_indexes()
+        self.database.commit()
+
+    def create_indexes(self):
+        """
+        Indexes keyframe tracks, is_tweened joins every line and ellipse with the other keyframes of its track
+        :return:
+        """
+
+        for table in (line, ellipse):
+            self.query.execute(f"CREATE INDEX IF NOT EXISTS {table}_track ON {table}(track, frame_id)")
+
+    def migrate(self):
+        """
+        Brings a project created by an older version of Paintmate to the current tables description
+        :return:
+        """
+
+        for table_name, description in self.tables_description.items():
+            columns = [elem[1] for elem in self.query.execute(f"PRAGMA table_info({table_name})").fetchall()]
+            if not columns:
+                self.query.execute(f"CREATE TABLE {table_name} (id INTEGER PRIMARY KEY AUTOINCREMENT, {description})")
+                continue
+            for column in description.split(", "):
+                if column.split()[0] not in columns:
+                    self.query.execute(f"ALTER TABLE {table_name} ADD COLUMN {column}")
+        self.query.execute("UPDATE setting SET onion_before = 1, onion_after = 0 WHERE onion_before IS NULL")
+        self.query.execute("UPDATE setting SET revision = (SELECT COALESCE(MAX(revision), 0) FROM frame_state) "
+                           "WHERE revision IS NULL")
+        for table in (line, ellipse):
+            self.query.execute(f"UPDATE {table} SET bound_x = MIN(x, xx), bound_y = MIN(y, yy), "
+                               f"bound_xx = MAX(x, xx), bound_yy = MAX(y, yy) WHERE bound_x IS NULL")
+        for table in (pen, filler):
+            self.query.execute(f"UPDATE {table} SET "
+                               f"bound_x = (SELECT MIN(x) FROM {table}_point WHERE {table}_id = {table}.id), "
+                               f"bound_y = (SELECT MIN(y) FROM {table}_point WHERE {table}_id = {table}.id), "
+                               f"bound_xx = (SELECT MAX(x) FROM {table}_point WHERE {table}_id = {table}.id), "
+                               f"bound_yy = (SELECT MAX(y) FROM {table}_point WHERE {table}_id = {table}.id) "
+                               f"WHERE bound_x IS NULL")
+        self.create_indexes()
         self.database.commit()
 
     def load_settings(self):
@@ -942,8 +3152,8 @@ class Database(DeviceInfo):
         self.database.commit()
         self.load_settings()
 
-    def set_object_properties(self, object_identifier, new_name, new_stroke_width, new_stroke_color, new_filler_color):
-        _, object_type, identifier = object_identifier.split('_')
+    def set_object_properties(self, object_type, identifier, new_name, new_stroke_width, new_stroke_color,
+                              new_filler_color):
         if new_stroke_color and isinstance(new_stroke_color, tuple):
             new_stroke_color = '|'.join(map(str, new_stroke_color))
         if new_filler_color and isinstance(new_filler_color, tuple):
@@ -963,10 +3173,12 @@ class Database(DeviceInfo):
             self.query.execute(f"UPDATE line SET stroke_width = {new_stroke_width}, "
                                f"color = '{new_stroke_color}', name = '{new_name}' "
                                f"WHERE id = {identifier}")
+        self.touch_frame(f"(SELECT frame_id FROM {object_type} WHERE id = {identifier})")
         self.database.commit()
 
-    def remove_object(self, object_identifier):
-        _, object_type, identifier = object_identifier.split('_')
+    def remove_object(self, object_type, identifier):
+        self.spatial_index.remove((object_type, identifier))
+        self.touch_frame(f"(SELECT frame_id FROM {object_type} WHERE id = {identifier})")
         if object_type in (ellipse, line):
             self.query.execute(f"DELETE FROM {object_type} WHERE id = {identifier}")
         else:
@@ -975,52 +3187,59 @@ class Database(DeviceInfo):
                                f"SELECT id FROM {object_type})")
         self.database.commit()
 
-    def get_object_poperties(self, object_identifier):
-        name, object_type, identifier = object_identifier.split('_')
+    def get_object_poperties(self, object_type, identifier):
         if object_type == pen:
-            return (name, identifier) + self.query.execute(f"SELECT stroke_width, color, NULL as fill_color "
-                                                           f"FROM pen WHERE id = {identifier}").fetchall()[0]
+            return self.query.execute(f"SELECT name, id, stroke_width, color, NULL as fill_color "
+                                      f"FROM pen WHERE id = {identifier}").fetchall()[0]
         elif object_type == filler:
-            return (name, identifier) + self.query.execute(f"SELECT NULL as stroke_width, color, NULL as fill_color "
-                                                           f"FROM filler WHERE id = {identifier}").fetchall()[0]
+            return self.query.execute(f"SELECT name, id, NULL as stroke_width, color, NULL as fill_color "
+                                      f"FROM filler WHERE id = {identifier}").fetchall()[0]
         elif object_type == line:
-            return (name, identifier) + self.query.execute(f"SELECT stroke_width, color, NULL as fill_color "
-                                                           f"FROM line WHERE id = {identifier}").fetchall()[0]
+            return self.query.execute(f"SELECT name, id, stroke_width, color, NULL as fill_color "
+                                      f"FROM line WHERE id = {identifier}").fetchall()[0]
         else:  # ellipse
-            return (name, identifier) + self.query.execute(f"SELECT stroke_width, color, fill_color "
-                                                           f"FROM ellipse WHERE id = {identifier}").fetchall()[0]
+            return self.query.execute(f"SELECT name, id, stroke_width, color, fill_color "
+                                      f"FROM ellipse WHERE id = {identifier}").fetchall()[0]
 
-    def set_z_index(self, object_identifier, addition):
-        _, object_type, identidier = object_identifier.split('_')
-        self.query.execute(f"UPDATE {object_type} SET z_index = z_index + {addition} WHERE id = {identidier}")
+    def set_z_index(self, object_type, identifier, addition):
+        self.query.execute(f"UPDATE {object_type} SET z_index = z_index + {addition} WHERE id = {identifier}")
+        self.touch_frame(f"(SELECT frame_id FROM {object_type} WHERE id = {identifier})")
+        self.database.commit()
 
     def duplicate_frame(self, frame_for_copying, after_that):
         self.query.execute(f"UPDATE ellipse SET frame_id = frame_id + 1 WHERE frame_id > {after_that}")
         self.query.execute(f"UPDATE filler SET frame_id = frame_id + 1 WHERE frame_id > {after_that}")
         self.query.execute(f"UPDATE pen SET frame_id = frame_id + 1 WHERE frame_id > {after_that}")
         self.query.execute(f"UPDATE line SET frame_id = frame_id + 1 WHERE frame_id > {after_that}")
+        self.shift_frame_states(after_that, 1)
         frame_for_copying += 1 if after_that < frame_for_copying else 0
-        for elem in self.query.execute(f"SELECT * FROM ellipse WHERE frame_id = {frame_for_copying}").fetchall():
-            self.query.execute("INSERT INTO ellipse(frame_id, stroke_width, color, x, y, xx, yy, fill_color, z_index, "
-                               "name) "
-                               f"VALUES({after_that + 1}, {elem[2]}, '{elem[3]}', {elem[4]}, {elem[5]}, {elem[6]}, "
-                               f"{elem[7]}, '{elem[8]}', {elem[9]}, '{elem[10]}')")
-        for elem in self.query.execute(f"SELECT * FROM filler WHERE frame_id = {frame_for_copying}").fetchall():
-            self.query.execute("INSERT INTO filler(frame_id, color, z_index, name) "
-                               f"VALUES({after_that + 1}, '{elem[2]}', {elem[3]}, '{elem[4]}')")
-            for el in self.object_points(elem[0], filler):
-                self.query.execute("INSERT INTO filler_point(filler_id, x, y) VALUES("
-                                   f"(SELECT id FROM filler ORDER BY -id LIMIT 1), {el[2]}, {el[3]})")
-        for elem in self.query.execute(f"SELECT * FROM pen WHERE frame_id = {frame_for_copying}").fetchall():
-            self.query.execute("INSERT INTO pen(frame_id, stroke_width, color, z_index, name) "
-                               f"VALUES({after_that + 1}, {elem[2]}, '{elem[3]}', {elem[4]}, '{elem[5]}')")
-            for el in self.object_points(elem[0], pen):
-                self.query.execute("INSERT INTO pen_point(pen_id, x, y) VALUES("
-                                   f"(SELECT id FROM pen ORDER BY -id LIMIT 1), {el[2]}, {el[3]})")
-        for elem in self.query.execute(f"SELECT * FROM line WHERE frame_id = {frame_for_copying}").fetchall():
-            self.query.execute("INSERT INTO line(frame_id, stroke_width, color, x, y, xx, yy, z_index, name) "
-                               f"VALUES({after_that + 1}, {elem[2]}, '{elem[3]}', {elem[4]}, {elem[5]}, {elem[6]}, "
-                               f"{elem[7]}, {elem[8]}, '{elem[9]}')")
+        self.query.execute("INSERT INTO frame_state(frame, revision, content_hash, exposure) "
+                           f"SELECT {after_that + 1}, {project_revision}, content_hash, exposure FROM frame_state "
+                           f"WHERE frame = {frame_for_copying}")
+        self.query.execute("INSERT INTO ellipse(frame_id, stroke_width, color, x, y, xx, yy, fill_color, z_index, "
+                           "name, bound_x, bound_y, bound_xx, bound_yy, track) "
+                           f"SELECT {after_that + 1}, stroke_width, color, x, y, xx, yy, fill_color, z_index, name, "
+                           f"bound_x, bound_y, bound_xx, bound_yy, track FROM ellipse "
+                           f"WHERE frame_id = {frame_for_copying}")
+        for elem in self.query.execute(f"SELECT id FROM filler WHERE frame_id = {frame_for_copying}").fetchall():
+            self.query.execute("INSERT INTO filler(frame_id, color, z_index, name, "
+                               "bound_x, bound_y, bound_xx, bound_yy) "
+                               f"SELECT {after_that + 1}, color, z_index, name, bound_x, bound_y, bound_xx, bound_yy "
+                               f"FROM filler WHERE id = {elem[0]}")
+            self.query.execute("INSERT INTO filler_point(filler_id, x, y) "
+                               f"SELECT {self.query.lastrowid}, x, y FROM filler_point WHERE filler_id = {elem[0]}")
+        for elem in self.query.execute(f"SELECT id FROM pen WHERE frame_id = {frame_for_copying}").fetchall():
+            self.query.execute("INSERT INTO pen(frame_id, stroke_width, color, z_index, name, "
+                               "bound_x, bound_y, bound_xx, bound_yy) "
+                               f"SELECT {after_that + 1}, stroke_width, color, z_index, name, "
+                               f"bound_x, bound_y, bound_xx, bound_yy FROM pen WHERE id = {elem[0]}")
+            self.query.execute("INSERT INTO pen_point(pen_id, x, y) "
+                               f"SELECT {self.query.lastrowid}, x, y FROM pen_point WHERE pen_id = {elem[0]}")
+        self.query.execute("INSERT INTO line(frame_id, stroke_width, color, x, y, xx, yy, z_index, name, "
+                           "bound_x, bound_y, bound_xx, bound_yy, track) "
+                           f"SELECT {after_that + 1}, stroke_width, color, x, y, xx, yy, z_index, name, "
+                           f"bound_x, bound_y, bound_xx, bound_yy, track FROM line "
+                           f"WHERE frame_id = {frame_for_copying}")
         self.database.commit()
 
     def delete_frame(self, frame):
@@ -1032,10 +3251,68 @@ class Database(DeviceInfo):
         for elem in "filler_point, pen_point".split(", "):
             self.query.execute(f"DELETE FROM {elem} WHERE {elem.split('_')[0] + '_' + 'id'} NOT IN "
                                f"(SELECT id FROM {elem.split('_')[0]})")
+        self.query.execute(f"DELETE FROM frame_state WHERE frame = {frame}")
+        self.shift_frame_states(frame, -1)
+        self.database.commit()
+
+    def touch_frame(self, frame):
+        """
+        Marks a frame as changed: gives it a new revision and forgets its content hash, the caller commits
+        :param frame: frame number or an SQL subquery that selects it
+        :return:
+        """
+
+        self.query.execute("UPDATE setting SET revision = revision + 1")
+        self.query.execute(f"INSERT INTO frame_state(frame, revision) VALUES({frame}, {project_revision}) "
+                           f"ON CONFLICT(frame) DO UPDATE SET revision = excluded.revision, content_hash = NULL")
+
+    def shift_frame_states(self, after_that, delta):
+        """
+        Moves revisions and hashes of the frames after the given one along with their objects. Moved frames get a
+        new revision, so a hash computed before the move isn't stored under the new number
+        :param after_that:
+        :param delta: 1 or -1
+        :return:
+        """
+
+        self.query.execute("UPDATE setting SET revision = revision + 1")
+        self.query.execute(f"UPDATE frame_state SET frame = -(frame + {delta}), revision = {project_revision} "
+                           f"WHERE frame > {after_that}")
+        self.query.execute("UPDATE frame_state SET frame = -frame WHERE frame < 0")
+
+    def frame_exposure(self, frame):
+        """
+        How many output frames a frame is held for
+        :param frame:
+        :return:
+        """
+
+        exposure = self.query.execute(f"SELECT exposure FROM frame_state WHERE frame = {frame}").fetchone()
+        return exposure[0] if exposure and exposure[0] else 1
+
+    def exposures(self):
+        """
+        Exposures of all frames at once, for the timeline and the renderer
+        :return: list, the first element belongs to the first frame
+        """
+
+        exposures = [1] * self.settings[count_of_frames]
+        for frame, exposure in self.query.execute("SELECT frame, exposure FROM frame_state WHERE exposure > 1"):
+            if frame <= len(exposures):
+                exposures[frame - 1] = exposure
+        return exposures
+
+    def set_frame_exposure(self, frame, exposure):
+        self.query.execute(f"INSERT INTO frame_state(frame, revision, exposure) "
+                           f"VALUES({frame}, {project_revision}, {exposure}) "
+                           f"ON CONFLICT(frame) DO UPDATE SET exposure = {exposure}")
         self.database.commit()
 
-    def reposition(self, object_name, delta_x, delta_y):
-        _, table, identifier = object_name.split('_')
+    def reposition(self, table, identifier, delta_x, delta_y):
+        self.query.execute(f"UPDATE {table} "
+                           f"SET bound_x = bound_x + {delta_x}, bound_y = bound_y + {delta_y}, "
+                           f"bound_xx = bound_xx + {delta_x}, bound_yy = bound_yy + {delta_y} "
+                           f"WHERE id = {identifier}")
         if table == "filler":
             self.query.execute(f"UPDATE {table}_point "
                                f"SET x = x + {delta_x}, y = y + {delta_y} "
@@ -1048,12 +3325,15 @@ class Database(DeviceInfo):
             self.query.execute(f"UPDATE {table} "
                                f"SET x = x + {delta_x}, y = y + {delta_y}, xx = xx + {delta_x}, yy = yy + {delta_y} "
                                f"WHERE id = {identifier}")
+        self.touch_frame(f"(SELECT frame_id FROM {table} WHERE id = {identifier})")
         self.database.commit()
+        self.spatial_index.move((table, identifier), delta_x, delta_y)
 
     def create_pen_object(self):
         self.query.execute(f"INSERT INTO pen(frame_id, stroke_width, color, z_index, name) VALUES("
                            f"{self.settings[current_frame]}, {self.settings[stroke_width]}, '{self.settings[color]}', "
                            f"0, 'Pen')")
+        self.touch_frame("(SELECT frame_id FROM pen ORDER BY -id LIMIT 1)")
         self.database.commit()
 
     def create_pen_point(self, x, y, current_width, current_height):
@@ -1061,11 +3341,18 @@ class Database(DeviceInfo):
         y = int(y * self.settings[height] / current_height)
         self.query.execute(f"INSERT INTO pen_point(pen_id, x, y) VALUES("
                            f"(SELECT id FROM pen ORDER BY -id LIMIT 1), {x}, {y})")
+        self.query.execute(f"UPDATE pen SET bound_x = MIN(COALESCE(bound_x, {x}), {x}), "
+                           f"bound_y = MIN(COALESCE(bound_y, {y}), {y}), "
+                           f"bound_xx = MAX(COALESCE(bound_xx, {x}), {x}), "
+                           f"bound_yy = MAX(COALESCE(bound_yy, {y}), {y}) "
+                           f"WHERE id = (SELECT id FROM pen ORDER BY -id LIMIT 1)")
+        self.touch_frame("(SELECT frame_id FROM pen ORDER BY -id LIMIT 1)")
         self.database.commit()
 
     def create_filler_object(self):
         self.query.execute(f"INSERT INTO filler(frame_id, color, z_index, name) VALUES("
                            f"{self.settings[current_frame]}, '{self.settings[color]}', 0, 'Filler')")
+        self.touch_frame("(SELECT frame_id FROM filler ORDER BY -id LIMIT 1)")
         self.database.commit()
 
     def create_filler_point(self, x, y, current_width, current_height):
@@ -1073,64 +3360,272 @@ class Database(DeviceInfo):
         y = int(y * self.settings[height] / current_height)
         self.query.execute(f"INSERT INTO filler_point(filler_id, x, y) VALUES("
                            f"(SELECT id FROM filler ORDER BY -id LIMIT 1), {x}, {y})")
+        self.query.execute(f"UPDATE filler SET bound_x = MIN(COALESCE(bound_x, {x}), {x}), "
+                           f"bound_y = MIN(COALESCE(bound_y, {y}), {y}), "
+                           f"bound_xx = MAX(COALESCE(bound_xx, {x}), {x}), "
+                           f"bound_yy = MAX(COALESCE(bound_yy, {y}), {y}) "
+                           f"WHERE id = (SELECT id FROM filler ORDER BY -id LIMIT 1)")
+        self.touch_frame("(SELECT frame_id FROM filler ORDER BY -id LIMIT 1)")
         self.database.commit()
 
     def create_line_object(self, x, y, current_width, current_height):
         x = int(x * self.settings[width] / current_width)
         y = int(y * self.settings[height] / current_height)
-        self.query.execute(f"INSERT INTO line(frame_id, stroke_width, color, x, y, xx, yy, z_index, name) VALUES("
+        self.query.execute(f"INSERT INTO line(frame_id, stroke_width, color, x, y, xx, yy, z_index, name, "
+                           f"bound_x, bound_y, bound_xx, bound_yy) VALUES("
                            f"{self.settings[current_frame]}, {self.settings[stroke_width]}, '{self.settings[color]}', "
-                           f"{x}, {y}, {x}, {y}, 0, 'Line')")
+                           f"{x}, {y}, {x}, {y}, 0, 'Line', {x}, {y}, {x}, {y})")
+        self.touch_frame("(SELECT frame_id FROM line ORDER BY -id LIMIT 1)")
         self.database.commit()
 
     def update_last_line_object(self, x, y, current_width, current_height):
         x = int(x * self.settings[width] / current_width)
         y = int(y * self.settings[height] / current_height)
-        self.query.execute(f"UPDATE line SET xx = {x}, yy = {y} WHERE id = (SELECT id FROM line ORDER BY -id LIMIT 1)")
+        self.query.execute(f"UPDATE line SET xx = {x}, yy = {y}, bound_x = MIN(x, {x}), bound_y = MIN(y, {y}), "
+                           f"bound_xx = MAX(x, {x}), bound_yy = MAX(y, {y}) "
+                           f"WHERE id = (SELECT id FROM line ORDER BY -id LIMIT 1)")
+        self.touch_frame("(SELECT frame_id FROM line ORDER BY -id LIMIT 1)")
         self.database.commit()
 
     def create_ellipse_object(self, x, y, current_width, current_height):
         x = int(x * self.settings[width] / current_width)
         y = int(y * self.settings[height] / current_height)
         self.query.execute(f"INSERT INTO ellipse(frame_id, stroke_width, color, x, y, xx, yy, fill_color, z_index, "
-                           f"name) "
+                           f"name, bound_x, bound_y, bound_xx, bound_yy) "
                            f"VALUES("
                            f"{self.settings[current_frame]}, {self.settings[stroke_width]}, '{self.settings[color]}', "
-                           f"{x}, {y}, {x}, {y}, '{self.settings[fill_color]}', 0, 'Ellipse')")
+                           f"{x}, {y}, {x}, {y}, '{self.settings[fill_color]}', 0, 'Ellipse', {x}, {y}, {x}, {y})")
+        self.touch_frame("(SELECT frame_id FROM ellipse ORDER BY -id LIMIT 1)")
         self.database.commit()
 
     def update_last_ellipse_object(self, x, y, current_width, current_height):
         x = int(x * self.settings[width] / current_width)
         y = int(y * self.settings[height] / current_height)
-        self.query.execute(f"UPDATE ellipse SET xx = {x}, yy = {y} WHERE id = ("
+        self.query.execute(f"UPDATE ellipse SET xx = {x}, yy = {y}, bound_x = MIN(x, {x}), bound_y = MIN(y, {y}), "
+                           f"bound_xx = MAX(x, {x}), bound_yy = MAX(y, {y}) WHERE id = ("
                            f"SELECT id FROM ellipse ORDER BY -id LIMIT 1)")
+        self.touch_frame("(SELECT frame_id FROM ellipse ORDER BY -id LIMIT 1)")
         self.database.commit()
 
-    def objects(self, frame_offset=0):
+    def objects(self, frame_offset=0, area=None, frame=None):
+        """
+        Returns the frame objects ordered by z-index
+        :param frame_offset: how many frames back from the current one
+        :param area: optional (x, y, xx, yy) rectangle in project coordinates, objects whose stroked bounds don't
+        intersect it are skipped
+        :param frame: absolute frame number, overrides frame_offset
+        :return:
+        """
+
+        if frame is None:
+            frame = self.settings[current_frame] - frame_offset
+        area_condition = ""
+        if area:
+            area_condition = (f"AND bound_xx + COALESCE(stroke_width, 0) >= {area[0]} "
+                              f"AND bound_x - COALESCE(stroke_width, 0) <= {area[2]} "
+                              f"AND bound_yy + COALESCE(stroke_width, 0) >= {area[1]} "
+                              f"AND bound_y - COALESCE(stroke_width, 0) <= {area[3]}")
         with self.database:
             self.query = self.database.cursor()
-            return self.query.execute(f'''SELECT id, frame_id, stroke_width, color, x, y, xx, yy, z_index, fill_color, 
-                                          name 
-                                          FROM ellipse WHERE frame_id = {self.settings[current_frame] - frame_offset} 
+            objects = self.query.execute(f'''SELECT id, frame_id, stroke_width, color, x, y, xx, yy, z_index, 
+                                          fill_color, name, 'ellipse' as type, bound_x, bound_y, bound_xx, bound_yy 
+                                          FROM ellipse WHERE frame_id = {frame} {area_condition} 
                                           UNION
                                           SELECT id, frame_id, stroke_width, color, x, y, xx, yy, z_index, 
-                                          NULL as fill_color, name FROM line WHERE frame_id = 
-                                          {self.settings[current_frame] - frame_offset} 
+                                          NULL as fill_color, name, 'line' as type, bound_x, bound_y, bound_xx, 
+                                          bound_yy FROM line WHERE frame_id = {frame} {area_condition} 
                                           UNION
                                           SELECT id, frame_id, stroke_width, color, NULL as x, NULL as y, NULL as xx, 
-                                          NULL as yy, z_index, NULL as fill_color, name FROM pen
-                                          WHERE frame_id = {self.settings[current_frame] - frame_offset} 
+                                          NULL as yy, z_index, NULL as fill_color, name, 'pen' as type, bound_x, 
+                                          bound_y, bound_xx, bound_yy FROM pen
+                                          WHERE frame_id = {frame} {area_condition} 
                                           UNION
                                           SELECT id, frame_id, NULL as stroke_width, color, NULL as x, NULL as y, 
-                                          NULL as xx, NULL as yy, z_index, NULL as fill_color, name FROM filler 
-                                          WHERE frame_id = {self.settings[current_frame] - frame_offset} 
+                                          NULL as xx, NULL as yy, z_index, NULL as fill_color, name, 'filler' as type, 
+                                          bound_x, bound_y, bound_xx, bound_yy FROM filler 
+                                          WHERE frame_id = {frame} {area_condition} 
                                           ORDER BY
                                           z_index''').fetchall()
+        tweens = self.tweens(frame, area)
+        return sorted(objects + tweens, key=lambda elem: elem[8]) if tweens else objects
+
+    def tweens(self, frame, area=None):
+        """
+        In-between states of keyframed lines and ellipses. Coordinates and stroke widths of all tracks are
+        interpolated by one query per table, colors are blended afterwards. The rows have the layout of "objects"
+        with negated ids of the previous keyframes, so they are painted but can't be selected
+        :param frame:
+        :param area: the same as in "objects"
+        :return:
+        """
+
+        share = f"(({frame} - a.frame_id) * 1.0 / (b.frame_id - a.frame_id))"
+        numbers = ", ".join(f"CAST(ROUND(a.{column} + (b.{column} - a.{column}) * {share}) AS INTEGER)"
+                            for column in (stroke_width, "x", "y", "xx", "yy"))
+        tweens = list()
+        for table in (line, ellipse):
+            fill_colors = "a.fill_color, b.fill_color" if table == ellipse else "NULL, NULL"
+            for (identifier, object_stroke_width, x, y, xx, yy, first_color, last_color, first_fill_color,
+                 last_fill_color, object_z_index, name, tween_share) in self.query.execute(
+                    f"SELECT -a.id, {numbers}, a.color, b.color, {fill_colors}, a.z_index, a.name, {share} "
+                    f"FROM {table} a JOIN {table} b ON b.track = a.track "
+                    f"WHERE a.frame_id = (SELECT MAX(frame_id) FROM {table} WHERE track = a.track "
+                    f"AND frame_id <= {frame}) AND a.frame_id < {frame} "
+                    f"AND b.frame_id = (SELECT MIN(frame_id) FROM {table} WHERE track = a.track "
+                    f"AND frame_id > {frame})").fetchall():
+                bounds = (min(x, xx), min(y, yy), max(x, xx), max(y, yy))
+                if area and (bounds[2] + object_stroke_width < area[0] or bounds[0] - object_stroke_width > area[2] or
+                             bounds[3] + object_stroke_width < area[1] or bounds[1] - object_stroke_width > area[3]):
+                    continue
+                object_color = blend_colors(first_color, last_color, tween_share)
+                object_fill_color = blend_colors(first_fill_color, last_fill_color, tween_share) \
+                    if first_fill_color else None
+                tweens.append((identifier, frame, object_stroke_width, object_color, x, y, xx, yy, object_z_index,
+                               object_fill_color, name, table) + bounds)
+        return tweens
+
+    def is_tweened(self, frame):
+        """
+        Whether a frame lies between keyframes of some object, then its picture depends on other frames too
+        :param frame:
+        :return:
+        """
+
+        for table in (line, ellipse):
+            if self.query.execute(f"SELECT 1 FROM {table} a JOIN {table} b ON b.track = a.track "
+                                  f"WHERE a.frame_id <= {frame} AND b.frame_id >= {frame} AND a.id != b.id "
+                                  f"LIMIT 1").fetchone():
+                return True
+        return False
+
+    def add_keyframe(self, object_type, identifier, frame):
+        """
+        Copies a line or an ellipse to another frame as a keyframe of the same track, a previous keyframe of the
+        track in that frame is replaced
+        :param object_type: "line" or "ellipse"
+        :param identifier:
+        :param frame:
+        :return:
+        """
+
+        columns = "stroke_width, color, x, y, xx, yy, z_index, name, bound_x, bound_y, bound_xx, bound_yy, track" + \
+                  (", fill_color" if object_type == ellipse else "")
+        self.query.execute(f"UPDATE {object_type} SET track = id WHERE id = {identifier} AND track IS NULL")
+        self.query.execute(f"DELETE FROM {object_type} WHERE frame_id = {frame} AND track = ("
+                           f"SELECT track FROM {object_type} WHERE id = {identifier})")
+        self.query.execute(f"INSERT INTO {object_type}(frame_id, {columns}) "
+                           f"SELECT {frame}, {columns} FROM {object_type} WHERE id = {identifier}")
+        self.touch_frame(frame)
+        self.database.commit()
 
     def object_points(self, object_id, table):
         return self.query.execute(f"SELECT * FROM {table}_point WHERE "
                                   f"{table}_id = {object_id}").fetchall()
 
+    def frame_hash(self, frame):
+        """
+        Content hash of a frame, it depends only on what is drawn, so equal frames share it whatever their ids are.
+        It is stored until the frame is touched again, frames between keyframes are hashed every time.
+        The hash is stored only if the revision read with it is still current, so a frame touched or renumbered by
+        another connection while hashing keeps its NULL. A frame without a state is stored only if no frame got a new
+        revision meanwhile
+        :param frame:
+        :return: hex digest
+        """
+
+        if self.is_tweened(frame):
+            return self.compute_frame_hash(frame)
+        state = self.query.execute(f"SELECT revision, content_hash FROM frame_state WHERE frame = {frame}").fetchone()
+        if state and state[1]:
+            return state[1]
+        latest = self.query.execute("SELECT revision FROM setting").fetchone()[0]
+        content_hash = self.compute_frame_hash(frame)
+        if state:
+            self.query.execute(f"UPDATE frame_state SET content_hash = '{content_hash}' "
+                               f"WHERE frame = {frame} AND revision = {state[0]}")
+        else:
+            self.query.execute(f"INSERT OR IGNORE INTO frame_state(frame, revision, content_hash) "
+                               f"SELECT {frame}, {latest}, '{content_hash}' "
+                               f"WHERE {project_revision} = {latest}")
+        self.database.commit()
+        return content_hash
+
+    def compute_frame_hash(self, frame):
+        digest = hashlib.sha1()
+        for elem in self.objects(frame=frame):
+            digest.update(repr(elem[2:8] + elem[9:10] + elem[11:12]).encode())
+            if elem[11] in (pen, filler):
+                digest.update(repr([point[2:] for point in self.object_points(elem[0], elem[11])]).encode())
+        return digest.hexdigest()
+
+    def cache_directory(self, kind):
+        """
+        Returns a per-project cache directory next to the project file, creates it if needed
+        :param kind: name of the cache, e.g. "thumbnails"
+        :return:
+        """
+
+        path = os.path.join(f"{os.path.abspath(self.database_file)}.cache", kind)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def index_frame(self, objects):
+        """
+        Rebuilds the spatial index from a snapshot of the current frame returned by "objects"
+        :param objects:
+        :return:
+        """
+
+        self.spatial_index.clear()
+        for order, elem in enumerate(objects):
+            identifier, object_stroke_width, object_type, (x, y, xx, yy) = elem[0], elem[2], elem[11], elem[12:16]
+            if x is None:
+                continue
+            padding = hit_tolerance + (object_stroke_width or 0)
+            self.spatial_index.insert((object_type, identifier), (x - padding, y - padding, xx + padding, yy + padding),
+                                      order)
+
+    def hit_test(self, px, py):
+        """
+        Finds the topmost object of the current frame under the point, uses the spatial index for candidates and
+        then an exact geometry test
+        :param px: x in project coordinates
+        :param py: y in project coordinates
+        :return: (object_type, identifier) or None
+        """
+
+        for object_type, identifier in self.spatial_index.query(px, py):
+            if object_type in (pen, filler):
+                points = [(x, y) for _, __, x, y in self.object_points(identifier, object_type)]
+                if object_type == filler:
+                    if point_in_polygon(px, py, points):
+                        return object_type, identifier
+                    continue
+                object_stroke_width = self.query.execute(f"SELECT stroke_width FROM pen "
+                                                         f"WHERE id = {identifier}").fetchone()[0]
+                if min(point_to_segment_distance(px, py, *a, *b) for a, b in zip(points, points[1:] or points)) <= \
+                        object_stroke_width + hit_tolerance:
+                    return object_type, identifier
+                continue
+            object_stroke_width, x, y, xx, yy = self.query.execute(f"SELECT stroke_width, x, y, xx, yy FROM "
+                                                                   f"{object_type} WHERE id = {identifier}").fetchone()
+            reach = object_stroke_width / 2 + hit_tolerance
+            if object_type == line:
+                if point_to_segment_distance(px, py, x, y, xx, yy) <= reach:
+                    return object_type, identifier
+                continue
+            # ellipse, its transparent inside can't be hit
+            center_x, center_y, radius_x, radius_y = (x + xx) / 2, (y + yy) / 2, abs(xx - x) / 2, abs(yy - y) / 2
+            outer = ((px - center_x) / (radius_x + reach)) ** 2 + ((py - center_y) / (radius_y + reach)) ** 2
+            if outer > 1:
+                continue
+            object_fill_color = self.query.execute(f"SELECT fill_color FROM ellipse "
+                                                   f"WHERE id = {identifier}").fetchone()[0]
+            if int(object_fill_color.split('|')[-1]) or radius_x <= reach or radius_y <= reach or \
+                    ((px - center_x) / (radius_x - reach)) ** 2 + ((py - center_y) / (radius_y - reach)) ** 2 >= 1:
+                return object_type, identifier
+        return None
+
 
 if __name__ == "__main__":
     application = QApplication(sys.argv)
@@ -0,0 +1,116 @@
+"""
+Synthetic Paintmate projects for benchmarks. The tables are created by Database.populate, so a generated project
+has exactly the schema of a project made in the editor. Run it directly to write one project:
+python benchmarks/generate.py project.sqlite --frames 100 --objects 50 --points 30
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+# opened projects are remembered in a throwaway list, not in the one of the user
+os.environ["PAINTMATE_RECENT_PROJECTS"] = tempfile.mkdtemp()
+invocation_directory = os.getcwd()
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+os.chdir(root)
+
+from PyQt5.QtWidgets import QApplication
+
+import Paintmate
+
+# constants
+object_types = (Paintmate.pen, Paintmate.line, Paintmate.ellipse, Paintmate.filler)
+qt_application = None
+
+
+def application():
+    """
+    Database inherits DeviceInfo, so a QApplication has to exist before any project is opened
+    :return:
+    """
+
+    global qt_application
+    qt_application = QApplication.instance() or QApplication(sys.argv[:1])
+    return qt_application
+
+
+def random_color(generator):
+    return '|'.join(str(generator.randrange(256)) for _ in range(3)) + "|255"
+
+
+def generate_project(path, frames=24, objects_per_frame=50, points_per_stroke=30, canvas_width=1920,
+                     canvas_height=1080, seed=0):
+    """
+    Writes a project with the given amount of content, pens, lines, ellipses and fillers take turns
+    :param path: new .sqlite file
+    :param frames:
+    :param objects_per_frame:
+    :param points_per_stroke: points of every pen and filler
+    :param canvas_width:
+    :param canvas_height:
+    :param seed: the same seed gives the same project
+    :return: Database connected to the project
+    """
+
+    application()
+    generator = random.Random(seed)
+    database = Paintmate.Database()
+    database.connect(path)
+    database.populate()
+    database.query.execute(f"UPDATE setting SET count_of_frames = {frames}, width = {canvas_width}, "
+                           f"height = {canvas_height}")
+    for frame in range(1, frames + 1):
+        for number in range(objects_per_frame):
+            object_type = object_types[number % len(object_types)]
+            x, y = generator.randrange(canvas_width), generator.randrange(canvas_height)
+            row = {"frame_id": frame, "color": random_color(generator), "z_index": number,
+                   "name": object_type.capitalize()}
+            if object_type != Paintmate.filler:
+                row["stroke_width"] = generator.randint(1, 12)
+            if object_type == Paintmate.ellipse:
+                row["fill_color"] = random_color(generator)
+            if object_type in (Paintmate.line, Paintmate.ellipse):
+                points = [(x, y), (min(canvas_width, x + generator.randrange(1, 300)),
+                                   min(canvas_height, y + generator.randrange(1, 300)))]
+                row.update(zip(("x", "y", "xx", "yy"), points[0] + points[1]))
+            else:
+                points = [(min(canvas_width, max(0, x + generator.randint(-150, 150))),
+                           min(canvas_height, max(0, y + generator.randint(-150, 150))))
+                          for _ in range(points_per_stroke)]
+            row.update(bound_x=min(elem[0] for elem in points), bound_y=min(elem[1] for elem in points),
+                       bound_xx=max(elem[0] for elem in points), bound_yy=max(elem[1] for elem in points))
+            database.query.execute(f"INSERT INTO {object_type}({', '.join(row)}) VALUES({', '.join('?' * len(row))})",
+                                   tuple(row.values()))
+            if object_type in (Paintmate.pen, Paintmate.filler):
+                database.query.executemany(f"INSERT INTO {object_type}_point({object_type}_id, x, y) VALUES(?, ?, ?)",
+                                           [(database.query.lastrowid, *elem) for elem in points])
+    database.database.commit()
+    database.load_settings()
+    return database
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generates a synthetic Paintmate project")
+    parser.add_argument("path")
+    parser.add_argument("--frames", type=int, default=24)
+    parser.add_argument("--objects", type=int, default=50, help="objects per frame")
+    parser.add_argument("--points", type=int, default=30, help="points per pen and filler")
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--seed", type=int, default=0)
+    arguments = parser.parse_args()
+    path = os.path.join(invocation_directory, arguments.path)
+    if os.path.exists(path):
+        print(f"{arguments.path} already exists")
+        return 1
+    generate_project(path, arguments.frames, arguments.objects, arguments.points,
+                     arguments.width, arguments.height, arguments.seed)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,242 @@
+"""
+Golden-image regression harness: renders a corpus of projects through the reference path, Canvas.render_frame,
+and through every alternative engine, then compares them pixel by pixel and with SSIM. Mismatching frames are saved
+as reference | engine | diff strips. Any faster paint or render path should pass it before it lands:
+python benchmarks/golden.py --project my_animation.sqlite
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+from collections import OrderedDict
+
+from generate import application, generate_project, invocation_directory
+from hot_paths import wait_for
+
+import numpy
+from PyQt5.QtCore import QRect
+from PyQt5.QtGui import QImage, QPainter
+
+import Paintmate
+
+# constants
+corpus = {"small": {"frames": 3, "objects_per_frame": 20, "points_per_stroke": 10, "canvas_width": 320,
+                    "canvas_height": 240, "seed": 1},
+          "dense": {"frames": 2, "objects_per_frame": 300, "points_per_stroke": 40, "canvas_width": 1280,
+                    "canvas_height": 720, "seed": 2},
+          "portrait": {"frames": 2, "objects_per_frame": 60, "points_per_stroke": 25, "canvas_width": 480,
+                       "canvas_height": 854, "seed": 3}}
+mismatch = 0.001
+tiles_per_side = 3
+render_tile_size = 100
+ssim_window = 8
+ssim_c1 = (0.01 * 255) ** 2
+ssim_c2 = (0.03 * 255) ** 2
+
+
+def reference(window, frame):
+    return Paintmate.image_to_bgr(window.canvas.render_frame(frame)).copy()
+
+
+def cached_raster(window, frame):
+    """
+    The raster cache behind scrubbing and the onion skin, asked for the full project resolution
+    """
+
+    settings = window.database.settings
+    image = window.canvas.frame_raster(OrderedDict(), 1, frame, max(settings[Paintmate.width],
+                                                                     settings[Paintmate.height]))
+    return Paintmate.image_to_bgr(image).copy()
+
+
+def exposed_tiles(window, frame):
+    """
+    Paints the frame tile by tile with the exposed rectangle set, as partial repaints of the canvas do, so the
+    spatial culling of Database.objects is checked
+    """
+
+    settings = window.database.settings
+    image = QImage(settings[Paintmate.width], settings[Paintmate.height], QImage.Format_ARGB32)
+    tile_width = -(-image.width() // tiles_per_side)
+    tile_height = -(-image.height() // tiles_per_side)
+    for x in range(0, image.width(), tile_width):
+        for y in range(0, image.height(), tile_height):
+            exposed = QRect(x, y, tile_width, tile_height)
+            painter = QPainter(image)
+            painter.setClipRect(exposed)
+            window.canvas.paint_frame(painter, image.width(), image.height(), exposed, frame)
+            painter.end()
+    return Paintmate.image_to_bgr(image).copy()
+
+
+def render_tiles(window, frame):
+    """
+    The tiled render of very large canvases with small tiles, so every project of the corpus is split
+    """
+
+    settings = window.database.settings
+    pixels = numpy.empty((settings[Paintmate.height], settings[Paintmate.width], 3), numpy.uint8)
+    window.canvas.render_tiles(frame, pixels, render_tile_size)
+    return pixels
+
+
+def numpy_rasterizer(window, frame):
+    """
+    The Qt-free rasterizer, it samples pixel centers like aliased Qt painting but outlines of ellipses and curved
+    edges may still differ by a pixel
+    """
+
+    settings = window.database.settings
+    pixels = numpy.empty((settings[Paintmate.height], settings[Paintmate.width], 3), numpy.uint8)
+    return Paintmate.rasterize_frame(window.database, frame, pixels)
+
+
+engines = {"cached_raster": cached_raster, "exposed_tiles": exposed_tiles, "render_tiles": render_tiles,
+           "numpy": numpy_rasterizer}
+engine_mismatch = {"numpy": 0.005}
+
+
+def box_mean(values, size):
+    """
+    Mean over every size x size window through an integral image
+    :param values: 2D float array
+    :param size:
+    :return: array smaller by size - 1 along both axes
+    """
+
+    integral = numpy.pad(values, ((1, 0), (1, 0))).cumsum(0).cumsum(1)
+    return (integral[size:, size:] - integral[:-size, size:] - integral[size:, :-size]
+            + integral[:-size, :-size]) / (size * size)
+
+
+def ssim(first, last):
+    """
+    Mean structural similarity of the luma of two BGR arrays, 1 means identical
+    """
+
+    weights = numpy.array((0.114, 0.587, 0.299))
+    first, last = first.astype(numpy.float64) @ weights, last.astype(numpy.float64) @ weights
+    size = min(ssim_window, *first.shape)
+    mean_first, mean_last = box_mean(first, size), box_mean(last, size)
+    variance_first = box_mean(first * first, size) - mean_first ** 2
+    variance_last = box_mean(last * last, size) - mean_last ** 2
+    covariance = box_mean(first * last, size) - mean_first * mean_last
+    numerator = (2 * mean_first * mean_last + ssim_c1) * (2 * covariance + ssim_c2)
+    denominator = (mean_first ** 2 + mean_last ** 2 + ssim_c1) * (variance_first + variance_last + ssim_c2)
+    return float(numpy.mean(numerator / denominator))
+
+
+def compare(expected, actual, tolerance):
+    """
+    :param expected: BGR array of the reference
+    :param actual: BGR array of an engine
+    :param tolerance: largest allowed difference of a channel
+    :return: dict with the share of mismatching pixels, the largest difference, SSIM and the mismatch mask
+    """
+
+    if expected.shape != actual.shape:
+        return {"mismatch": 1.0, "max_difference": 255, "ssim": 0.0, "mask": None}
+    difference = numpy.abs(expected.astype(numpy.int16) - actual.astype(numpy.int16)).max(axis=2)
+    mask = difference > tolerance
+    return {"mismatch": float(mask.mean()), "max_difference": int(difference.max()), "ssim": ssim(expected, actual),
+            "mask": mask}
+
+
+def to_image(pixels):
+    pixels = numpy.ascontiguousarray(pixels[..., ::-1])
+    return QImage(pixels.data, pixels.shape[1], pixels.shape[0], pixels.strides[0], QImage.Format_RGB888).copy()
+
+
+def from_image(path):
+    image = QImage(path)
+    return None if image.isNull() else Paintmate.image_to_bgr(image).copy()
+
+
+def save_diff(path, expected, actual, mask):
+    """
+    Writes reference, engine output and a diff where mismatching pixels are red over the faded reference
+    """
+
+    if mask is None:
+        to_image(actual).save(path)
+        return
+    diff = (expected // 4 + 191).astype(numpy.uint8)
+    diff[mask] = (0, 0, 255)
+    to_image(numpy.hstack((expected, actual, diff))).save(path)
+
+
+def projects(paths):
+    """
+    Generates the synthetic corpus into a temporary directory and adds the given project files
+    :return: dict of name and project file
+    """
+
+    directory = tempfile.mkdtemp()
+    result = dict()
+    for name, parameters in corpus.items():
+        result[name] = os.path.join(directory, f"{name}.sqlite")
+        generate_project(result[name], **parameters).database.close()
+    for path in paths:
+        result[os.path.splitext(os.path.basename(path))[0]] = os.path.join(invocation_directory, path)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compares Paintmate render engines with the reference painting")
+    parser.add_argument("--project", action="append", default=list(), help="extra .sqlite project of the corpus")
+    parser.add_argument("--engine", action="append", choices=sorted(engines), help="engines to check, all by default")
+    parser.add_argument("--golden", help="directory of stored reference images, the live reference by default")
+    parser.add_argument("--update", action="store_true", help="write the reference images into --golden and exit")
+    parser.add_argument("--tolerance", type=int, default=2, help="largest allowed difference of a channel")
+    parser.add_argument("--mismatch", type=float, help="allowed share of mismatching pixels, "
+                                                         f"{mismatch} or the engine_mismatch of the engine by default")
+    parser.add_argument("--min-ssim", type=float, default=0.98)
+    parser.add_argument("--diffs", default="golden_diffs", help="directory for diff images of failed frames")
+    arguments = parser.parse_args()
+    if arguments.update and not arguments.golden:
+        parser.error("--update needs --golden")
+    application()
+    window = Paintmate.Paintmate()
+    golden = arguments.golden and os.path.join(invocation_directory, arguments.golden)
+    diffs = os.path.join(invocation_directory, arguments.diffs)
+    failures = checks = 0
+    for name, path in projects(arguments.project).items():
+        if window.canvas is not None:
+            window.restart()
+        wait_for(lambda: window.choose_project_window is not None)
+        window.open_project(path)
+        wait_for(lambda: window.canvas is not None)
+        for frame in range(1, window.database.settings[Paintmate.count_of_frames] + 1):
+            golden_path = golden and os.path.join(golden, name, f"{frame}.png")
+            if arguments.update:
+                os.makedirs(os.path.dirname(golden_path), exist_ok=True)
+                to_image(reference(window, frame)).save(golden_path)
+                continue
+            expected = from_image(golden_path) if golden else reference(window, frame)
+            if expected is None:
+                print(f"{name} {frame}: no golden image, run with --update")
+                failures += 1
+                continue
+            for engine in arguments.engine or sorted(engines):
+                actual = engines[engine](window, frame)
+                result = compare(expected, actual, arguments.tolerance)
+                checks += 1
+                allowed = arguments.mismatch if arguments.mismatch is not None \
+                    else engine_mismatch.get(engine, mismatch)
+                passed = result["mismatch"] <= allowed and result["ssim"] >= arguments.min_ssim
+                print(f"{'ok  ' if passed else 'FAIL'} {name:<12}{frame:>5} {engine:<16}"
+                      f"mismatch {result['mismatch']:.5f}  max {result['max_difference']:>3}  "
+                      f"ssim {result['ssim']:.5f}")
+                if not passed:
+                    failures += 1
+                    os.makedirs(diffs, exist_ok=True)
+                    save_diff(os.path.join(diffs, f"{name}_{frame}_{engine}.png"), expected, actual, result["mask"])
+    window.thumbnail_strip.close_worker()
+    if not arguments.update:
+        print(f"{checks - failures} of {checks} checks passed" + (f", diffs are in {diffs}" if failures else ""))
+    return int(failures > 0)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
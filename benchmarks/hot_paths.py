@@ -0,0 +1,162 @@
+"""
+Times the hot paths of Paintmate on a synthetic project under the offscreen platform and writes the results to JSON,
+so runs on different commits can be compared: python benchmarks/hot_paths.py --output results.json
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from generate import application, generate_project, invocation_directory, root
+
+from PyQt5.QtCore import PYQT_VERSION_STR, QT_VERSION_STR
+
+import Paintmate
+
+# constants
+timeout_s = 600
+
+
+def measure(function, repeat):
+    """
+    :param function: callable without arguments
+    :param repeat:
+    :return: timings in milliseconds
+    """
+
+    timings = list()
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - start_time) * 1000)
+    return {"repeat": repeat, "min_ms": round(min(timings), 3), "median_ms": round(statistics.median(timings), 3),
+            "mean_ms": round(statistics.mean(timings), 3)}
+
+
+def single(start_time):
+    elapsed = round((time.perf_counter() - start_time) * 1000, 3)
+    return {"repeat": 1, "min_ms": elapsed, "median_ms": elapsed, "mean_ms": elapsed}
+
+
+def wait_for(condition):
+    start_time = time.perf_counter()
+    while not condition():
+        if time.perf_counter() - start_time > timeout_s:
+            raise TimeoutError("benchmark step didn't finish in time")
+        application().processEvents()
+        time.sleep(0.001)
+
+
+def database_paths(path, repeat):
+    database = Paintmate.Database()
+    database.connect(path)
+    database.load_settings()
+    count = database.settings[Paintmate.count_of_frames]
+    frames = itertools.cycle(range(1, count + 1))
+    strokes = itertools.cycle(database.query.execute("SELECT id, 'pen' FROM pen UNION ALL "
+                                                     "SELECT id, 'filler' FROM filler").fetchall())
+    results = {"Database.objects": measure(lambda: database.objects(frame=next(frames)), repeat),
+               "Database.object_points": measure(lambda: database.object_points(*next(strokes)), repeat),
+               "Database.duplicate_frame": measure(lambda: database.duplicate_frame(1, count // 2), repeat)}
+    database.query.execute(f"UPDATE setting SET count_of_frames = {count + repeat}")
+    database.database.commit()
+    database.load_settings()
+    results["Database.delete_frame"] = measure(lambda: database.delete_frame(count // 2 + 1), repeat)
+    database.database.close()
+    return results
+
+
+def render(window, name, is_sequence, codec):
+    """
+    Runs a full PaintmateRender into a temporary directory, the raw frames cache is cleared so nothing is reused
+    :return: timing in milliseconds
+    """
+
+    shutil.rmtree(os.path.join(f"{os.path.abspath(window.database.database_file)}.cache", "frames"),
+                  ignore_errors=True)
+    os.chdir(tempfile.mkdtemp())
+    start_time = time.perf_counter()
+    renderer = Paintmate.PaintmateRender(name, is_sequence, window, codec)
+    wait_for(lambda: hasattr(renderer, "render_status") and renderer.render_status.text().startswith("завершено"))
+    result = single(start_time)
+    renderer.close()
+    os.chdir(root)
+    return result
+
+
+def editor_paths(path, repeat):
+    window = Paintmate.Paintmate()
+    wait_for(lambda: window.choose_project_window is not None)
+    window.open_project(path)
+    wait_for(lambda: window.canvas is not None and window.canvas.isVisible())
+    results = {"Canvas.paintEvent": measure(window.canvas.repaint, repeat)}
+
+    def next_frame():
+        window.to_next_frame()
+        window.canvas.repaint()
+
+    results["Canvas.paintEvent after a frame change"] = measure(next_frame, repeat)
+    window.to_first_frame()
+    results["PaintmateRender png sequence"] = render(window, "sequence", True, "png")
+    try:
+        import cv2
+    except ImportError:
+        cv2 = None
+    if cv2 is not None:
+        results["PaintmateRender h264 video"] = render(window, "video.mp4", False, "h264")
+    window.thumbnail_strip.close_worker()
+    return results
+
+
+def commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=root, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Times Paintmate hot paths on a synthetic project")
+    parser.add_argument("--frames", type=int, default=24)
+    parser.add_argument("--objects", type=int, default=200, help="objects per frame")
+    parser.add_argument("--points", type=int, default=30, help="points per pen and filler")
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark_results.json")
+    arguments = parser.parse_args()
+    application()
+    path = os.path.join(tempfile.mkdtemp(), "benchmark.sqlite")
+    parameters = {"frames": arguments.frames, "objects_per_frame": arguments.objects,
+                  "points_per_stroke": arguments.points, "canvas_width": arguments.width,
+                  "canvas_height": arguments.height, "repeat": arguments.repeat, "seed": arguments.seed}
+    start_time = time.perf_counter()
+    generate_project(path, arguments.frames, arguments.objects, arguments.points, arguments.width,
+                     arguments.height, arguments.seed).database.close()
+    results = {"generate_project": single(start_time)}
+    results.update(database_paths(path, arguments.repeat))
+    path = os.path.join(tempfile.mkdtemp(), "benchmark.sqlite")
+    generate_project(path, arguments.frames, arguments.objects, arguments.points, arguments.width, arguments.height,
+                     arguments.seed).database.close()
+    results.update(editor_paths(path, arguments.repeat))
+    report = {"commit": commit(), "python": platform.python_version(), "qt": QT_VERSION_STR, "pyqt": PYQT_VERSION_STR,
+              "platform": platform.platform(), "parameters": parameters, "results": results}
+    with open(os.path.join(invocation_directory, arguments.output), 'w') as report_file:
+        json.dump(report, report_file, indent=4)
+    for name, elem in results.items():
+        print(f"{name:<42}{elem['min_ms']:>12.3f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,76 @@
+"""
+Startup time of Paintmate: from the interpreter start to the painted project picker and from there to the first
+painted canvas of a new project. Run it from anywhere: python benchmarks/startup.py
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+start_time = time.perf_counter()
+# opened projects are remembered in a throwaway list, not in the one of the user
+os.environ["PAINTMATE_RECENT_PROJECTS"] = tempfile.mkdtemp()
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+os.chdir(root)
+
+from PyQt5.QtCore import QEvent, QObject, QTimer
+from PyQt5.QtWidgets import QApplication
+
+import Paintmate
+
+# constants
+budget_ms = 500
+timeout_ms = 30000
+
+
+class PaintWatcher(QObject):
+    """
+    Application-wide event filter that remembers when the first widgets of the given classes were painted
+    """
+
+    def __init__(self, on_paint):
+        super().__init__()
+        self.on_paint = on_paint
+
+    def eventFilter(self, watched, event):
+        if event.type() == QEvent.Paint:
+            self.on_paint(watched)
+        return False
+
+
+def main():
+    application = QApplication(sys.argv)
+    project_file = os.path.join(tempfile.mkdtemp(), "benchmark.sqlite")
+    timings = dict()
+
+    def on_paint(widget):
+        if isinstance(widget, Paintmate.ChooseProjectWindow) and "picker" not in timings:
+            timings["picker"] = time.perf_counter()
+            QTimer.singleShot(0, lambda: window.open_project(project_file, True))
+        elif isinstance(widget, Paintmate.Canvas) and "canvas" not in timings:
+            timings["canvas"] = time.perf_counter()
+            application.quit()
+
+    watcher = PaintWatcher(on_paint)
+    application.installEventFilter(watcher)
+    timings["import"] = time.perf_counter()
+    window = Paintmate.Paintmate()
+    QTimer.singleShot(timeout_ms, application.quit)
+    application.exec()
+    if "canvas" not in timings:
+        print("the canvas wasn't painted in time")
+        return 1
+    print(f"imports: {(timings['import'] - start_time) * 1000:.0f} ms")
+    print(f"project picker: {(timings['picker'] - start_time) * 1000:.0f} ms")
+    print(f"first canvas paint: {(timings['canvas'] - timings['picker']) * 1000:.0f} ms after the picker")
+    print(f"heavy modules loaded: {', '.join(name for name in ('cv2', 'numpy') if name in sys.modules) or 'none'}")
+    editor_ms = (timings['canvas'] - start_time) * 1000
+    print(f"to an interactive editor: {editor_ms:.0f} ms, budget {budget_ms} ms: "
+          f"{'ok' if editor_ms <= budget_ms else 'exceeded'}")
+    return 0 if editor_ms <= budget_ms else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -69,7 +69,7 @@ class Ui_Form(object):
         self.horizontalLayout_3.addWidget(self.cancel_button)
         spacerItem1 = QtWidgets.QSpacerItem(80, 20, QtWidgets.QSizePolicy.Fixed, QtWidgets.QSizePolicy.Minimum)
         self.horizontalLayout_3.addItem(spacerItem1)
-        self.gridLayout.addLayout(self.horizontalLayout_3, 8, 1, 1, 1)
+        self.gridLayout.addLayout(self.horizontalLayout_3, 9, 1, 1, 1)
         self.horizontalLayout_6 = QtWidgets.QHBoxLayout()
         self.horizontalLayout_6.setObjectName("horizontalLayout_6")
         spacerItem2 = QtWidgets.QSpacerItem(80, 20, QtWidgets.QSizePolicy.Fixed, QtWidgets.QSizePolicy.Minimum)
@@ -106,9 +106,12 @@ class Ui_Form(object):
         self.label_3.setStyleSheet("color: #69697e;")
         self.label_3.setAlignment(QtCore.Qt.AlignRight|QtCore.Qt.AlignTrailing|QtCore.Qt.AlignVCenter)
         self.label_3.setObjectName("label_3")
-        self.gridLayout.addWidget(self.label_3, 9, 1, 1, 1)
+        self.gridLayout.addWidget(self.label_3, 10, 1, 1, 1)
+        self.options_layout = QtWidgets.QVBoxLayout()
+        self.options_layout.setObjectName("options_layout")
+        self.gridLayout.addLayout(self.options_layout, 7, 1, 1, 1)
         spacerItem5 = QtWidgets.QSpacerItem(20, 40, QtWidgets.QSizePolicy.Minimum, QtWidgets.QSizePolicy.Expanding)
-        self.gridLayout.addItem(spacerItem5, 7, 1, 1, 1)
+        self.gridLayout.addItem(spacerItem5, 8, 1, 1, 1)
         self.verticalLayout_2 = QtWidgets.QVBoxLayout()
         self.verticalLayout_2.setObjectName("verticalLayout_2")
         self.horizontalLayout_5 = QtWidgets.QHBoxLayout()